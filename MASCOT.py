@@ -1,11 +1,37 @@
 import os
+import re
+import io
+import sys
+import gzip
 import json
+import math
+import time
+import zlib
+import uuid
+import socket
+import sqlite3
+import hashlib
+import hmac
+import importlib.util
+import unicodedata
+import argparse
+import datetime
+import cProfile
+import tracemalloc
+import contextlib
+import concurrent.futures
+import collections
+import multiprocessing
 import logging
 import threading
 import requests
+import requests.adapters
+import requests.structures
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from tkinter.scrolledtext import ScrolledText
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import openai
 
 # Set up logging
@@ -22,6 +48,8 @@ stop_flag = False
 
 AGENT_PROFILES = {
     "Echo": {
+        # "local" runs the built-in implementation from LOCAL_AGENTS; "llm" calls the model below
+        "type": "local",
         "model": "gpt-3.5-turbo",
         "system_prompt": (
             "You are **Echo**, the Input Reception agent.\n\n"
@@ -121,6 +149,8 @@ AGENT_PROFILES = {
     },
     "Critic": {
         "model": "gpt-4",
+        # "edits" asks for a list of replacements instead of a full rewrite; use "rewrite" for the original behaviour
+        "mode": "edits",
         "system_prompt": (
             "You are **Critic**, the Review and Refinement agent.\n\n"
             "**Your Role:**\n"
@@ -137,6 +167,7 @@ AGENT_PROFILES = {
         )
     },
     "Courier": {
+        "type": "local",
         "model": "gpt-3.5-turbo",
         "system_prompt": (
             "You are **Courier**, the Final Output Delivery agent.\n\n"
@@ -153,6 +184,2111 @@ AGENT_PROFILES = {
     }
 }
 
+# Pipeline stages in execution order, with the outputs each stage consumes
+PIPELINE_STAGES = [
+    ("Echo", ["query"]),
+    ("Hermes", ["Echo"]),
+    ("Analyst", ["Hermes"]),
+    ("Scribe", ["Analyst"]),
+    ("Architect", ["Echo", "Hermes", "Analyst", "Scribe"]),
+    ("Composer", ["Architect", "Analyst", "Scribe"]),
+    ("Critic", ["Composer"]),
+    ("Courier", ["Critic"]),
+]
+
+# Number of runs kept in the checkpoint file
+MAX_CHECKPOINT_RUNS = 50
+
+# Values offered for a profile's optional "mode" setting
+AGENT_MODES = ["", "edits", "rewrite", "sections"]
+
+# Appended to the Critic's system prompt in "edits" mode
+CRITIC_EDITS_INSTRUCTIONS = (
+    "\n\n**Output Format:**\n"
+    "- Do not rewrite the response. Reply only with a JSON object of the form "
+    '{"edits": [{"find": "...", "replace": "..."}]}.\n'
+    "- Each \"find\" must be copied exactly from the response and appear in it exactly once; "
+    "include enough surrounding words to make it unique.\n"
+    "- \"replace\" is the corrected text for that span. Keep each edit as short as possible.\n"
+    '- If the response needs no changes, reply with {"edits": []}.'
+)
+
+# Most Composer sections generated at once in "sections" mode
+COMPOSER_MAX_PARALLEL = 6
+
+# Appended to the Composer's system prompt for each section in "sections" mode
+COMPOSER_SECTION_INSTRUCTIONS = (
+    "\n\n**Section Instructions:**\n"
+    "- Other writers are composing the remaining sections of the plan at the same time.\n"
+    "- Write only the section you are assigned, starting with its heading as a Markdown '##' heading.\n"
+    "- Do not write an introduction or conclusion for the whole response unless that is your section.\n"
+    "- Do not repeat material that belongs to other sections of the plan."
+)
+
+COMPOSER_STITCH_PROMPT = (
+    "You are the editor joining sections of a response that were written independently.\n"
+    "For each numbered boundary you receive the end of one section and the start of the next. "
+    "Write one short transition sentence to append to the end of the earlier section so the response flows. "
+    'Reply only with a JSON object of the form {"transitions": ["...", "..."]}, one entry per boundary in order. '
+    "Use an empty string where no transition is needed."
+)
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+BOLD_HEADING_PATTERN = re.compile(r"^\*\*(.+?)\*\*:?$")
+NUMBERED_HEADING_PATTERN = re.compile(r"^(\d+|[IVXLC]+)[.)]\s+(.+)$")
+# "**Title**: description" inside a numbered item
+BOLD_LEAD_PATTERN = re.compile(r"^\*\*(.+?)\*\*\s*[:.\-\u2013\u2014]?\s*(.*)$")
+
+def markdown_sections(lines):
+    levels = [len(m.group(1)) for m in (HEADING_PATTERN.match(line.strip()) for line in lines) if m]
+    if not levels:
+        return []
+    level = min(levels)
+    # A single top-level heading is usually the plan's title
+    if levels.count(level) == 1 and any(l > level for l in levels):
+        level = min(l for l in levels if l > level)
+    def heading(line):
+        match = HEADING_PATTERN.match(line.strip())
+        return (match.group(2), "") if match and len(match.group(1)) == level else None
+    return split_sections(lines, heading)
+
+def bold_sections(lines):
+    def heading(line):
+        match = BOLD_HEADING_PATTERN.match(line.strip())
+        return (match.group(1), "") if match else None
+    return split_sections(lines, heading)
+
+def numbered_sections(lines):
+    matches = [m for m in map(NUMBERED_HEADING_PATTERN.match, lines) if m]
+    # Numbering that restarts belongs to lists under other headings, not to the plan's sections
+    if sum(m.group(1) in ("1", "I") for m in matches) > 1:
+        return []
+    def heading(line):
+        match = NUMBERED_HEADING_PATTERN.match(line)
+        if not match:
+            return None
+        text = match.group(2)
+        bold = BOLD_LEAD_PATTERN.match(text)
+        if bold:
+            return bold.group(1).strip(": "), bold.group(2)
+        return text.strip("*: "), ""
+    return split_sections(lines, heading)
+
+def split_sections(lines, heading):
+    # Each section is [title, body lines, index of its heading line]
+    sections = []
+    for index, line in enumerate(lines):
+        found = heading(line)
+        if found and found[0]:
+            title, description = found
+            sections.append([title, [description] if description else [], index])
+        elif sections:
+            sections[-1][1].append(line)
+    return sections
+
+def parse_plan_sections(plan):
+    """Split an Architect plan into (heading, details) pairs at its top-level headings.
+
+    Markdown headings, bold lines and unindented numbered items are tried in turn, and
+    the style that yields the most sections wins; ties go to the earlier style.
+    Returns an empty list if the plan has fewer than two sections.
+    """
+    lines = plan.splitlines()
+    styles = [markdown_sections(lines), bold_sections(lines), numbered_sections(lines)]
+    candidates = []
+    for rank, sections in enumerate(styles):
+        # An earlier style's heading below this style's first one means these are sub-items
+        if sections and any(other[2] > sections[0][2] for earlier in styles[:rank] for other in earlier):
+            continue
+        candidates.append(sections)
+    sections = max(candidates, key=len)
+    if len(sections) < 2:
+        return []
+    return [(title, "\n".join(body).strip()) for title, body, _ in sections]
+
+def first_paragraph(text):
+    return text.strip().split("\n\n")[0]
+
+def last_paragraph(text):
+    return text.strip().split("\n\n")[-1]
+
+# Documents are read and analysed in chunks of about this many characters (roughly 3000 tokens)
+DOCUMENT_CHUNK_CHARS = 12000
+# Chunks being mapped or merged at once; only these are held in memory
+DOCUMENT_MAX_PARALLEL = 4
+DOCUMENT_DEFAULT_INSTRUCTION = "Analyze this document and report its key points."
+# Stages mapped over a document's chunks; their checkpoints are tied to the document's digest
+DOCUMENT_STAGES = ("Hermes", "Analyst")
+DOCUMENT_CHUNK_PROMPT = "{instruction}\n\nThis is part {number} of a longer document:\n\n{chunk}"
+DOCUMENT_MERGE_INSTRUCTIONS = (
+    "\n\nYou are now combining two partial outputs you wrote for consecutive parts of one long document. "
+    "Merge them into a single output in the same format. Keep every distinct point, remove repetition, "
+    "and make the result no longer than the longer of the two."
+)
+
+def iter_document_chunks(source, chunk_chars=DOCUMENT_CHUNK_CHARS):
+    """Yield chunks of about chunk_chars characters from a text file object.
+
+    Chunks end at line breaks where possible. Lines are read with a size limit,
+    so a document without line breaks is still read one chunk at a time.
+    """
+    buffer, size = [], 0
+    for line in iter(lambda: source.readline(chunk_chars), ""):
+        if size + len(line) > chunk_chars and buffer:
+            chunk = "".join(buffer)
+            if chunk.strip():
+                yield chunk
+            buffer, size = [], 0
+        buffer.append(line)
+        size += len(line)
+    chunk = "".join(buffer)
+    if chunk.strip():
+        yield chunk
+
+class HierarchicalReducer:
+    """Merges partial results pairwise as a binary tree over their positions.
+
+    Two siblings are merged as soon as both are ready, by whichever thread adds the
+    second, so only partials still waiting for their sibling are held in memory.
+    """
+    def __init__(self, merge):
+        self.merge = merge
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.merges = 0
+
+    def add(self, index, value, level=0):
+        while True:
+            with self.lock:
+                sibling = self.pending.pop((level, index ^ 1), None)
+                if sibling is None:
+                    self.pending[(level, index)] = value
+                    return
+                self.merges += 1
+            left, right = (sibling, value) if index & 1 else (value, sibling)
+            value = self.merge(left, right)
+            level, index = level + 1, index >> 1
+
+    def result(self):
+        # Partials still waiting at the end cover disjoint ranges; merge them in document order
+        values = [self.pending[key] for key in sorted(self.pending, key=lambda key: key[1] << key[0])]
+        self.pending = {}
+        while len(values) > 1:
+            self.merges += len(values) // 2
+            values = [self.merge(*values[i:i + 2]) if i + 1 < len(values) else values[i]
+                      for i in range(0, len(values), 2)]
+        return values[0] if values else None
+
+metrics_file = "metrics.jsonl"
+metrics_lock = threading.Lock()
+
+def record_metric(**fields):
+    fields["time"] = time.time()
+    with metrics_lock:
+        with open(metrics_file, "a") as f:
+            f.write(json.dumps(fields) + "\n")
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+def parse_json_reply(reply):
+    # Models sometimes wrap JSON in a code fence or add a sentence around it
+    start, end = reply.find("{"), reply.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("Reply does not contain a JSON object.")
+    return json.loads(reply[start:end + 1])
+
+def apply_edits(text, edits):
+    for edit in edits:
+        find, replace = edit.get("find"), edit.get("replace")
+        if not isinstance(find, str) or not isinstance(replace, str) or not find:
+            raise ValueError(f"Malformed edit: {edit!r}")
+        count = text.count(find)
+        if count != 1:
+            raise ValueError(f"Edit target found {count} times: {find[:60]!r}")
+        text = text.replace(find, replace)
+    return text
+
+def read_config(config_file):
+    config = {}
+    if os.path.exists(config_file):
+        with open(config_file, "r") as f:
+            for line in f:
+                if '=' in line:
+                    key, value = line.strip().split('=', 1)
+                    config[key] = value
+    return config
+
+def read_agent_profiles(agent_profiles_file):
+    if os.path.exists(agent_profiles_file):
+        with open(agent_profiles_file, "r") as f:
+            profiles = json.load(f)
+        logging.info("Agent profiles loaded from file.")
+        return profiles
+    logging.info("No agent profiles file found. Using default profiles.")
+    return AGENT_PROFILES.copy()
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def stage_fingerprint(profile, inputs):
+    # A stage stays valid only while its profile and every input it consumed are unchanged,
+    # so editing one profile invalidates that agent and everything downstream of it.
+    return hash_text(json.dumps([profile, inputs], sort_keys=True))
+
+def is_agent_error(agent_name, output):
+    return output.startswith(f"Error in Agent {agent_name}")
+
+# Courier adds a summary to responses longer than this many words
+SUMMARY_MIN_WORDS = 250
+SUMMARY_SENTENCES = 3
+
+BULLET_PATTERN = re.compile(r"^(\s*)(?:[*•‣◦⁃–·]|-(?!-))\s+")
+NUMBERED_PATTERN = re.compile(r"^(\s*)(\d+)[.)]\s+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# Byte order marks, zero-width spaces and C0 controls other than newline and tab
+ECHO_STRIP_PATTERN = re.compile("[\x00-\x08\x0b-\x1f\u200b\ufeff]")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were "
+    "which with will can not also their there these those they you your we our".split()
+)
+
+def local_echo(user_query):
+    """Pass the query through verbatim, only normalizing encoding and whitespace."""
+    text = unicodedata.normalize("NFC", user_query).replace("\r\n", "\n").replace("\r", "\n")
+    # Joiners and bidi marks carry meaning, so only a small fixed set is dropped
+    text = ECHO_STRIP_PATTERN.sub("", text)
+    lines = [line.rstrip() for line in text.split("\n")]
+    return "\n".join(lines).strip("\n")
+
+def is_list_line(line):
+    return bool(BULLET_PATTERN.match(line) or NUMBERED_PATTERN.match(line))
+
+def heading_text(block):
+    """Return the heading text if a single-line block reads like a heading, else None."""
+    line = block.strip()
+    if not line:
+        return None
+    bold = re.fullmatch(r"\*\*(.+?)\*\*:?", line) or re.fullmatch(r"__(.+?)__:?", line)
+    if bold:
+        return bold.group(1).strip()
+    if len(line) > 80 or is_list_line(line) or line.startswith(("#", ">", "|")):
+        return None
+    if line.endswith(":") and len(line.split()) <= 10:
+        return line[:-1].strip()
+    words = line.split()
+    if line[-1] not in ".!?,;" and 1 <= len(words) <= 8 and all(w[0].isupper() or not w[0].isalpha() for w in words):
+        return line
+    return None
+
+def summarize(text, sentence_count=SUMMARY_SENTENCES):
+    """Pick the highest scoring sentences by word frequency, kept in their original order."""
+    prose = [line for line in text.split("\n") if line.strip() and not line.lstrip().startswith(("#", "|", "```"))]
+    sentences = [s.strip() for s in SENTENCE_PATTERN.split(" ".join(BULLET_PATTERN.sub("", l) for l in prose)) if s.strip()]
+    sentences = [s for s in dict.fromkeys(sentences) if len(s.split()) >= 6]
+    if len(sentences) <= sentence_count:
+        return " ".join(sentences)
+    frequencies = collections.Counter(w for w in WORD_PATTERN.findall(text.lower()) if w not in STOP_WORDS)
+    def score(sentence):
+        words = [w for w in WORD_PATTERN.findall(sentence.lower()) if w not in STOP_WORDS]
+        return sum(frequencies[w] for w in words) / (len(words) or 1)
+    ranked = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)[:sentence_count]
+    return " ".join(sentences[i] for i in sorted(ranked))
+
+def local_courier(critic_output):
+    """Format the final response as Markdown using fixed rules instead of a model call."""
+    text = local_echo(critic_output)
+    has_headings = bool(re.search(r"^#{1,6}\s", text, re.M))
+    blocks = []
+    in_code = False
+    for block in re.split(r"\n\s*\n", text):
+        if in_code or block.lstrip().startswith("```"):
+            # Leave code blocks untouched, including any blank lines inside them
+            if in_code:
+                blocks[-1] += "\n\n" + block
+            else:
+                blocks.append(block)
+            in_code = (in_code + block.count("```")) % 2 == 1
+            continue
+        lines = block.split("\n")
+        if len(lines) == 1 and not has_headings and heading_text(block):
+            blocks.append(f"## {heading_text(block)}")
+            continue
+        formatted = []
+        for line in lines:
+            line = BULLET_PATTERN.sub(r"\1- ", line)
+            line = NUMBERED_PATTERN.sub(r"\1\2. ", line)
+            # Keep lists separated from the paragraph that introduces them
+            if formatted and is_list_line(line) and not is_list_line(formatted[-1]):
+                formatted.append("")
+            elif formatted and not is_list_line(line) and is_list_line(formatted[-1]) and not line.startswith(" "):
+                formatted.append("")
+            formatted.append(line)
+        blocks.append("\n".join(formatted))
+    formatted_text = "\n\n".join(block for block in blocks if block.strip())
+    if len(formatted_text.split()) >= SUMMARY_MIN_WORDS and not re.search(r"^#+\s*(summary|abstract|tl;dr)", formatted_text, re.I | re.M):
+        summary = summarize(formatted_text)
+        if summary:
+            formatted_text = f"## Summary\n\n{summary}\n\n{formatted_text}"
+    return formatted_text
+
+# Agents that can run without a model call when their profile sets "type": "local"
+LOCAL_AGENTS = {
+    "Echo": local_echo,
+    "Courier": local_courier,
+}
+
+# Seconds each stage is assumed to take before metrics.jsonl has any history for it
+DEFAULT_STAGE_LATENCY = {
+    "Echo": 3.0,
+    "Hermes": 10.0,
+    "Analyst": 15.0,
+    "Scribe": 12.0,
+    "Architect": 12.0,
+    "Composer": 30.0,
+    "Critic": 15.0,
+    "Courier": 8.0,
+}
+LOCAL_STAGE_LATENCY = 0.05
+# Cheaper models a stage may be switched to when a deadline is tight
+FAST_MODELS = {
+    "gpt-4": "gpt-3.5-turbo",
+    "gpt-4-turbo": "gpt-3.5-turbo",
+    "gpt-4o": "gpt-4o-mini",
+}
+FAST_MODEL_SPEEDUP = 0.4
+# Output-token caps applied under a tight deadline, and how much they are assumed to save
+DEADLINE_TOKEN_CAPS = {
+    "Composer": 800,
+    "Architect": 400,
+    "Analyst": 500,
+    "Hermes": 300,
+}
+TOKEN_CAP_SPEEDUP = 0.6
+# Recent samples per stage and model used for the latency estimate
+LATENCY_WINDOW = 20
+# Only the tail of metrics.jsonl is read when estimating latencies
+LATENCY_HISTORY_BYTES = 1 << 20
+# Outputs returned when a deadline expires, best first
+BEST_OUTPUT_ORDER = ["Courier", "Critic", "Composer", "Analyst", "Hermes"]
+
+def load_latency_estimates():
+    """Median recent latency of each (stage, model) pair recorded in metrics.jsonl."""
+    samples = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+    try:
+        with open(metrics_file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - LATENCY_HISTORY_BYTES))
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    for line in lines:
+        try:
+            metric = json.loads(line)
+        except ValueError:
+            continue  # Partial first line of the tail, or a torn write
+        if metric.get("stage") in DEFAULT_STAGE_LATENCY and "model" in metric and "latency" in metric \
+                and not metric.get("error"):
+            samples[(metric["stage"], metric["model"])].append(metric["latency"])
+    return {key: sorted(values)[len(values) // 2] for key, values in samples.items()}
+
+def estimate_latency(stage, profile, estimates):
+    if profile.get("type") == "local" and stage in LOCAL_AGENTS:
+        return LOCAL_STAGE_LATENCY
+    model = profile.get("model")
+    latency = estimates.get((stage, model))
+    if latency is None:
+        latency = DEFAULT_STAGE_LATENCY[stage]
+        if model in FAST_MODELS.values():
+            latency *= FAST_MODEL_SPEEDUP
+    if profile.get("max_tokens"):
+        latency *= TOKEN_CAP_SPEEDUP
+    return latency
+
+def plan_for_deadline(agent_profiles, stages, budget, estimates):
+    """Choose the cheapest set of degradations expected to finish `stages` within `budget` seconds.
+
+    Returns (overrides, skipped, notes): profile overrides per stage, the stages to skip, and a
+    description of each degradation applied. Degradations are tried in order of how little they
+    cost in answer quality and applied only until the estimate fits.
+    """
+    overrides = {stage: {} for stage in stages}
+    skipped = set()
+    notes = {}
+
+    def total():
+        return sum(estimate_latency(stage, dict(agent_profiles[stage], **overrides[stage]), estimates)
+                   for stage in stages if stage not in skipped)
+
+    steps = []
+    for stage in ("Echo", "Courier"):
+        if stage in stages and agent_profiles[stage].get("type") != "local":
+            steps.append((stage, {"type": "local"}, "ran locally"))
+    if "Critic" in stages:
+        steps.append(("Critic", None, "skipped"))
+    for stage, cap in DEADLINE_TOKEN_CAPS.items():
+        if stage in stages and not agent_profiles[stage].get("max_tokens"):
+            steps.append((stage, {"max_tokens": cap}, f"capped at {cap} output tokens"))
+    # Switch the slowest stages to faster models first
+    for stage in sorted(stages, key=lambda s: -DEFAULT_STAGE_LATENCY[s]):
+        fast_model = FAST_MODELS.get(agent_profiles[stage].get("model"))
+        if fast_model and stage not in LOCAL_AGENTS:
+            steps.append((stage, {"model": fast_model}, f"used {fast_model}"))
+
+    for stage, change, note in steps:
+        if total() <= budget:
+            break
+        if change is None:
+            skipped.add(stage)
+        else:
+            overrides[stage].update(change)
+        notes.setdefault(stage, []).append(note)
+    return overrides, skipped, notes
+
+class CassetteMissError(KeyError):
+    pass
+
+class ReplayedResponse:
+    """Stands in for a requests.Response served from a cassette."""
+
+    def __init__(self, url, status_code, headers, text):
+        self.url = url
+        self.status_code = status_code
+        # Header lookups are case-insensitive, as on a live response
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.encoding = "utf-8"
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+class RecordingResponse:
+    """Wraps a streamed requests.Response and records only the part of the body the caller read.
+
+    Callers that stop reading early, at a size cap or a deadline, leave a recording of the
+    same shape as the live traffic. The entry is written when the response is closed.
+    """
+
+    def __init__(self, cassette, request, response, started):
+        self.cassette = cassette
+        self.request = request
+        self.response = response
+        self.started = started
+        self.body = b""
+        self.recorded = False
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for chunk in self.response.iter_content(chunk_size=chunk_size):
+            self.body += chunk
+            yield chunk
+
+    def close(self):
+        if not self.recorded:
+            self.recorded = True
+            self.cassette.write_http(self.request, self.response, self.started,
+                                     self.body.decode(self.response.encoding or "utf-8", errors="replace"))
+        self.response.close()
+
+class Cassette:
+    """Records outbound OpenAI and HTTP traffic to a gzip JSON-lines file, or replays it.
+
+    Entries are matched on a hash of the request with credentials removed, and
+    identical requests are served in the order they were recorded.
+    """
+
+    def __init__(self, path, mode, speed="recorded"):
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.entries = {}
+        if mode == "replay":
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["key"], collections.deque()).append(entry)
+            logging.info(f"Cassette {path} loaded for replay.")
+        else:
+            # Truncate, then append one gzip member per entry so a crash keeps everything recorded so far
+            with gzip.open(path, "wt", encoding="utf-8"):
+                pass
+            logging.info(f"Recording outbound traffic to {path}.")
+
+    @staticmethod
+    def request_key(kind, request):
+        return hash_text(json.dumps([kind, request], sort_keys=True, default=str))
+
+    def write(self, entry):
+        with self.lock:
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def take(self, kind, request):
+        key = self.request_key(kind, request)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise CassetteMissError(f"No recorded {kind} response for this request in {self.path}.")
+            return entries.popleft()
+
+    def wait(self, seconds):
+        if self.speed == "recorded" and seconds > 0:
+            time.sleep(seconds)
+
+    def chat_completion(self, create, kwargs):
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+        request = {k: v for k, v in kwargs.items() if k != "timeout"}
+        if self.mode == "replay":
+            entry = self.take("chat", request)
+            if entry["chunks"] is None:
+                self.wait(entry["elapsed"])
+                return ChatCompletion.model_validate(entry["response"])
+            return self.replay_chunks(entry["chunks"], ChatCompletionChunk)
+        started = time.perf_counter()
+        response = create(**kwargs)
+        if kwargs.get("stream"):
+            return self.record_chunks(request, response, started)
+        self.write({
+            "key": self.request_key("chat", request),
+            "kind": "chat",
+            "request": request,
+            "elapsed": time.perf_counter() - started,
+            "response": response.model_dump(),
+            "chunks": None,
+        })
+        return response
+
+    def record_chunks(self, request, stream, started):
+        chunks = []
+        for chunk in stream:
+            chunks.append([time.perf_counter() - started, chunk.model_dump()])
+            yield chunk
+        self.write({
+            "key": self.request_key("chat", request),
+            "kind": "chat",
+            "request": request,
+            "elapsed": time.perf_counter() - started,
+            "response": None,
+            "chunks": chunks,
+        })
+
+    def replay_chunks(self, chunks, chunk_type):
+        previous = 0.0
+        for offset, chunk in chunks:
+            self.wait(offset - previous)
+            previous = offset
+            yield chunk_type.model_validate(chunk)
+
+    def http_get(self, get, url, kwargs):
+        params = {k: v for k, v in (kwargs.get("params") or {}).items() if k != "key"}
+        request = {"url": url, "params": params}
+        if self.mode == "replay":
+            entry = self.take("http", request)
+            self.wait(entry["elapsed"])
+            response = entry["response"]
+            return ReplayedResponse(url, response["status_code"], response["headers"], response["text"])
+        started = time.perf_counter()
+        response = get(url, **kwargs)
+        if kwargs.get("stream"):
+            return RecordingResponse(self, request, response, started)
+        self.write_http(request, response, started, response.text)
+        return response
+
+    def write_http(self, request, response, started, text):
+        self.write({
+            "key": self.request_key("http", request),
+            "kind": "http",
+            "request": request,
+            "elapsed": time.perf_counter() - started,
+            "response": {"status_code": response.status_code, "headers": dict(response.headers), "text": text},
+            "chunks": None,
+        })
+
+# Weights for weighted fair queuing between priority classes
+PRIORITY_WEIGHTS = {"interactive": 8, "batch": 2, "background": 1}
+# Leases not renewed for this long are treated as left behind by a crashed process
+SLOT_LEASE_TTL = 30.0
+# How often a call waiting on another process's slots checks again
+SLOT_POLL_INTERVAL = 0.05
+
+class SlotLeases:
+    """Model-call slots shared by every MASCOT process on this host through a SQLite file.
+
+    Each running call holds a lease row, renewed in the background while its process
+    lives. Interactive calls waiting for a slot leave a waiter row, which holds back
+    batch and background calls in every process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = uuid.uuid4().hex
+        self.renewer = None
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS slot_leases (
+                    id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    priority TEXT NOT NULL,
+                    expires REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS slot_waiters (
+                    id TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    expires REAL NOT NULL
+                );
+            """)
+
+    def connect(self):
+        return contextlib.closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def acquire(self, lease_id, model, priority, limit, reserved):
+        """Take a slot for model if the limits across all processes allow it; return True on success."""
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM slot_leases WHERE expires < ?", (now,))
+                conn.execute("DELETE FROM slot_waiters WHERE expires < ?", (now,))
+                running = conn.execute(
+                    "SELECT COUNT(*) FROM slot_leases WHERE model = ?", (model,)
+                ).fetchone()[0]
+                if priority == "interactive":
+                    admitted = running < limit
+                else:
+                    waiting = conn.execute(
+                        "SELECT COUNT(*) FROM slot_waiters WHERE model = ?", (model,)
+                    ).fetchone()[0]
+                    admitted = running < limit - reserved and not waiting
+                if admitted:
+                    conn.execute("DELETE FROM slot_waiters WHERE id = ?", (lease_id,))
+                    conn.execute(
+                        "INSERT INTO slot_leases (id, owner, model, priority, expires) VALUES (?, ?, ?, ?, ?)",
+                        (lease_id, self.owner, model, priority, now + SLOT_LEASE_TTL)
+                    )
+                elif priority == "interactive":
+                    conn.execute(
+                        "INSERT OR REPLACE INTO slot_waiters (id, model, expires) VALUES (?, ?, ?)",
+                        (lease_id, model, now + SLOT_POLL_INTERVAL * 20)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if admitted:
+            self.start_renewer()
+        return admitted
+
+    def release(self, lease_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM slot_leases WHERE id = ?", (lease_id,))
+            conn.execute("DELETE FROM slot_waiters WHERE id = ?", (lease_id,))
+
+    def start_renewer(self):
+        with self.lock:
+            if self.renewer is not None:
+                return
+            self.renewer = threading.Thread(target=self.renew, daemon=True)
+            self.renewer.start()
+
+    def close(self):
+        # Stops renewing; leases still held by this instance expire after SLOT_LEASE_TTL
+        self.closed.set()
+
+    def renew(self):
+        while not self.closed.wait(SLOT_LEASE_TTL / 3):
+            try:
+                with self.connect() as conn:
+                    conn.execute("UPDATE slot_leases SET expires = ? WHERE owner = ?",
+                                 (time.time() + SLOT_LEASE_TTL, self.owner))
+            except sqlite3.Error as e:
+                logging.warning(f"Could not renew model slot leases: {e}")
+
+class AgentScheduler:
+    """Admits model calls by priority class under per-model concurrency limits.
+
+    Waiting calls are served in weighted-fair order of their virtual finish tags.
+    Interactive calls always go ahead of waiting batch and background calls for the
+    same model, and the last `interactive_reserved` slots of each model are held back
+    for them, so batch work gives up capacity at its next call instead of stalling
+    interactive queries.
+    """
+
+    def __init__(self, model_limits=None, default_limit=4, interactive_reserved=1, leases=None):
+        self.model_limits = model_limits or {}
+        self.default_limit = default_limit
+        self.interactive_reserved = interactive_reserved
+        self.leases = leases
+        self.condition = threading.Condition()
+        self.running = collections.Counter()
+        self.waiting = []
+        self.virtual_time = 0.0
+        self.last_finish = collections.defaultdict(float)
+        self.sequence = 0
+        self.wait_times = {priority: collections.deque(maxlen=1000) for priority in PRIORITY_WEIGHTS}
+
+    def configure(self, model_limits, default_limit, interactive_reserved, leases=None):
+        with self.condition:
+            self.model_limits = model_limits
+            self.default_limit = default_limit
+            self.interactive_reserved = interactive_reserved
+            self.leases = leases
+            self.condition.notify_all()
+
+    def limit(self, model):
+        return max(1, self.model_limits.get(model, self.default_limit))
+
+    def can_start(self, ticket):
+        finish, sequence, priority, model = ticket
+        limit = self.limit(model)
+        if self.running[model] >= limit:
+            return False
+        if priority != "interactive":
+            reserved = min(self.interactive_reserved, limit - 1)
+            if self.running[model] >= limit - reserved:
+                return False
+        for other in self.waiting:
+            if other[3] != model or other >= ticket:
+                continue
+            # Earlier tags go first, except that batch work never holds back an interactive call
+            if other[2] == "interactive" or priority != "interactive":
+                return False
+        if priority != "interactive" and any(t[2] == "interactive" and t[3] == model for t in self.waiting):
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def slot(self, model, priority="interactive"):
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority class: {priority}")
+        queued_at = time.perf_counter()
+        with self.condition:
+            self.sequence += 1
+            start = max(self.virtual_time, self.last_finish[priority])
+            ticket = (start + 1.0 / PRIORITY_WEIGHTS[priority], self.sequence, priority, model)
+            self.last_finish[priority] = ticket[0]
+            self.waiting.append(ticket)
+            leases = self.leases
+        lease_id = uuid.uuid4().hex
+        admitted = False
+        try:
+            while not admitted:
+                with self.condition:
+                    while not self.can_start(ticket):
+                        self.condition.wait()
+                    # Hold the slot here while other processes sharing the lease file are asked,
+                    # so the lock is never held across a SQLite transaction
+                    self.running[model] += 1
+                try:
+                    admitted = leases is None or self.acquire_lease(leases, lease_id, ticket)
+                finally:
+                    if not admitted:
+                        with self.condition:
+                            self.running[model] -= 1
+                            self.condition.notify_all()
+                            self.condition.wait(SLOT_POLL_INTERVAL)
+        finally:
+            with self.condition:
+                self.waiting.remove(ticket)
+                if admitted:
+                    self.virtual_time = max(self.virtual_time, start)
+                    self.wait_times[priority].append(time.perf_counter() - queued_at)
+                self.condition.notify_all()
+        try:
+            yield
+        finally:
+            if leases is not None:
+                try:
+                    leases.release(lease_id)
+                except sqlite3.Error as e:
+                    logging.warning(f"Could not release model slot lease: {e}")
+            with self.condition:
+                self.running[model] -= 1
+                self.condition.notify_all()
+
+    def acquire_lease(self, leases, lease_id, ticket):
+        _, _, priority, model = ticket
+        limit = self.limit(model)
+        try:
+            return leases.acquire(lease_id, model, priority, limit, min(self.interactive_reserved, limit - 1))
+        except sqlite3.Error as e:
+            # Never block calls on the lease file; fall back to this process's own limits
+            logging.warning(f"Model slot leases unavailable, scheduling within this process only: {e}")
+            return True
+
+    def stats(self):
+        """Return p50/p95 queueing delay in seconds for each priority class."""
+        with self.condition:
+            stats = {}
+            for priority, waits in self.wait_times.items():
+                ordered = sorted(waits)
+                if ordered:
+                    stats[priority] = {
+                        "calls": len(ordered),
+                        "p50": ordered[len(ordered) // 2],
+                        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    }
+            return stats
+
+# Shared by every agent call in this process
+scheduler = AgentScheduler()
+
+def configure_scheduler(config):
+    """Apply MODEL_CONCURRENCY (e.g. gpt-4:4,gpt-3.5-turbo:8) and related config.env settings."""
+    model_limits = {}
+    for item in config.get("MODEL_CONCURRENCY", "").split(","):
+        if ":" in item:
+            model, limit = item.rsplit(":", 1)
+            try:
+                model_limits[model.strip()] = int(limit)
+            except ValueError:
+                logging.warning(f"Ignoring invalid MODEL_CONCURRENCY entry: {item}")
+    # Processes sharing the lease file share each model's limits; an empty path keeps them per process
+    previous = scheduler.leases
+    leases = None
+    leases_path = config.get("SCHEDULER_DB", "scheduler.db")
+    if previous is not None and previous.path == leases_path:
+        leases = previous
+    elif leases_path:
+        try:
+            leases = SlotLeases(leases_path)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not open {leases_path}, scheduling within this process only: {e}")
+    scheduler.configure(
+        model_limits,
+        int(config.get("DEFAULT_MODEL_CONCURRENCY", 4)),
+        int(config.get("INTERACTIVE_RESERVED_SLOTS", 1)),
+        leases
+    )
+    if previous is not None and previous is not leases:
+        previous.close()
+
+# Set by install_cassette() to record or replay all outbound traffic
+cassette = None
+
+def install_cassette(path, mode, speed="recorded"):
+    global cassette
+    cassette = Cassette(path, mode, speed)
+
+# Transport settings; each can be overridden in config.env
+TRANSPORT_DEFAULTS = {
+    "TRANSPORT_POOL_SIZE": "16",
+    "TRANSPORT_KEEPALIVE": "60",
+    "TRANSPORT_HTTP2": "auto",
+    "TRANSPORT_CONNECT_TIMEOUT": "5",
+    "LLM_READ_TIMEOUT": "120",
+    "SEARCH_READ_TIMEOUT": "15",
+    "PAGE_READ_TIMEOUT": "5",
+    "DNS_CACHE_TTL": "60",
+}
+
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+
+class EndpointCounters:
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.requests = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0
+
+    def start(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        # Every pooled connection was busy when this request started
+        if self.in_flight > self.pool_size:
+            self.saturated += 1
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": max(0, self.requests - self.new_connections),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "pool_size": self.pool_size,
+            "saturated_requests": self.saturated,
+        }
+
+class CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, transport, name, **kwargs):
+        self.transport = transport
+        self.name = name
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        with self.transport.lock:
+            counters = self.transport.counters(self.name)
+            counters.start()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            # urllib3 counts the connections each host pool has opened
+            pools = [self.poolmanager.pools.get(key) for key in self.poolmanager.pools.keys()]
+            with self.transport.lock:
+                counters.in_flight -= 1
+                counters.new_connections = sum(pool.num_connections for pool in pools if pool is not None)
+
+class DNSCache:
+    """Caches socket.getaddrinfo results for a fixed time to skip repeated lookups."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.original = None
+
+    def install(self):
+        if self.original is None:
+            self.original = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        if self.original is not None:
+            if socket.getaddrinfo == self.getaddrinfo:
+                socket.getaddrinfo = self.original
+            self.original = None
+        with self.lock:
+            self.entries.clear()
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        result = self.original(*args, **kwargs)
+        with self.lock:
+            # Misses are rare, so drop every expired entry here rather than keeping them forever
+            for expired in [k for k, (expires, _) in self.entries.items() if expires <= now]:
+                del self.entries[expired]
+            self.entries[key] = (now + self.ttl, result)
+        return result
+
+class Transport:
+    """Owns the pooled HTTP clients for every endpoint MASCOT talks to.
+
+    OpenAI-compatible endpoints get an openai.OpenAI client per (base_url, api_key)
+    on a tuned httpx client; search and page fetches use named requests sessions.
+    Each endpoint keeps counters for requests, new versus reused connections and
+    pool saturation.
+    """
+
+    def __init__(self, config=None):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.openai_clients = {}
+        self.http_clients = {}
+        self.endpoint_counters = {}
+        self.dns_cache = None
+        # The DNS cache patches socket.getaddrinfo, so only configure() installs it
+        self.load_settings(config or {})
+
+    def configure(self, config):
+        """Apply config.env settings, installing, retuning or removing the DNS cache."""
+        self.load_settings(config)
+        if self.dns_ttl <= 0:
+            if self.dns_cache is not None:
+                self.dns_cache.uninstall()
+                self.dns_cache = None
+        elif self.dns_cache is None:
+            self.dns_cache = DNSCache(self.dns_ttl)
+            self.dns_cache.install()
+        else:
+            self.dns_cache.ttl = self.dns_ttl
+
+    def load_settings(self, config):
+        settings = dict(TRANSPORT_DEFAULTS)
+        settings.update({key: value for key, value in config.items() if key in TRANSPORT_DEFAULTS})
+        self.pool_size = int(settings["TRANSPORT_POOL_SIZE"])
+        self.keepalive = float(settings["TRANSPORT_KEEPALIVE"])
+        self.http2 = settings["TRANSPORT_HTTP2"].lower()
+        connect = float(settings["TRANSPORT_CONNECT_TIMEOUT"])
+        self.timeouts = {
+            "llm": (connect, float(settings["LLM_READ_TIMEOUT"])),
+            "search": (connect, float(settings["SEARCH_READ_TIMEOUT"])),
+            "pages": (connect, float(settings["PAGE_READ_TIMEOUT"])),
+        }
+        self.dns_ttl = float(settings["DNS_CACHE_TTL"])
+
+    def timeout(self, policy):
+        return self.timeouts[policy]
+
+    def counters(self, name):
+        counters = self.endpoint_counters.get(name)
+        if counters is None:
+            counters = self.endpoint_counters[name] = EndpointCounters(self.pool_size)
+        return counters
+
+    def session(self, name):
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is None:
+                session = requests.Session()
+                adapter = CountingHTTPAdapter(self, name, pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.sessions[name] = session
+            return session
+
+    def use_http2(self):
+        if self.http2 == "auto":
+            return importlib.util.find_spec("h2") is not None
+        return self.http2 in ("1", "true", "yes", "on")
+
+    def openai_client(self, base_url=None, api_key=None):
+        """Return the pooled client for an endpoint, or None when no API key is available yet."""
+        api_key = api_key or openai.api_key or (None if not base_url else "not-needed")
+        if not api_key:
+            return None
+        key = (base_url or None, api_key)
+        with self.lock:
+            client = self.openai_clients.get(key)
+            if client is None:
+                import httpx
+                name = base_url or DEFAULT_OPENAI_BASE_URL
+                counters = self.counters(name)
+                connect, read = self.timeouts["llm"]
+
+                lock = self.lock
+
+                def trace(event_name, info):
+                    if event_name == "connection.connect_tcp.complete":
+                        with lock:
+                            counters.new_connections += 1
+
+                class CountingTransport(httpx.HTTPTransport):
+                    def handle_request(self, request):
+                        request.extensions["trace"] = trace
+                        with lock:
+                            counters.start()
+                        try:
+                            return super().handle_request(request)
+                        finally:
+                            with lock:
+                                counters.in_flight -= 1
+
+                http_client = httpx.Client(
+                    transport=CountingTransport(
+                        limits=httpx.Limits(
+                            max_connections=self.pool_size,
+                            max_keepalive_connections=self.pool_size,
+                            keepalive_expiry=self.keepalive
+                        ),
+                        http2=self.use_http2()
+                    ),
+                    timeout=httpx.Timeout(read, connect=connect)
+                )
+                # Local inference servers usually ignore the key, but the client requires one
+                client = openai.OpenAI(base_url=base_url or None, api_key=api_key, http_client=http_client)
+                self.openai_clients[key] = client
+                self.http_clients[key] = (name, http_client)
+                logging.info(f"Created OpenAI client for {name}.")
+            return client
+
+    def preconnect(self, agent_profiles, google_api_key=None):
+        """Open connections to every configured endpoint in the background."""
+        def warm():
+            for profile in agent_profiles.values():
+                if profile.get("type") == "local":
+                    continue
+                self.openai_client(profile.get("base_url"), profile.get("api_key"))
+            with self.lock:
+                http_clients = list(self.http_clients.values())
+            for name, http_client in http_clients:
+                try:
+                    # Any response, even 404, leaves a warm connection in the pool
+                    http_client.head(name.rstrip("/") + "/models", timeout=self.timeouts["llm"][0])
+                except Exception as e:
+                    logging.info(f"Pre-connect to {name} failed: {e}")
+            if google_api_key:
+                try:
+                    self.session("search").head(GOOGLE_SEARCH_URL, timeout=self.timeouts["search"])
+                except Exception as e:
+                    logging.info(f"Pre-connect to Google Search failed: {e}")
+            logging.info("Transport pre-connect finished.")
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            stats = {name: counters.summary() for name, counters in self.endpoint_counters.items()}
+        if self.dns_cache:
+            stats["dns"] = {"hits": self.dns_cache.hits, "misses": self.dns_cache.misses}
+        return stats
+
+# Shared by every outbound request in this process
+transport = Transport()
+
+def configure_transport(config, agent_profiles):
+    transport.configure(config)
+    # Replayed runs must not touch the network
+    if not (cassette and cassette.mode == "replay"):
+        transport.preconnect(agent_profiles, config.get("GOOGLE_API_KEY"))
+
+def get_openai_client(base_url=None, api_key=None):
+    """Return the pooled client for a profile's endpoint, or None to use the module-level client."""
+    return transport.openai_client(base_url, api_key)
+
+def chat_completion(client=None, priority="interactive", **kwargs):
+    create = client.chat.completions.create if client else openai.chat.completions.create
+    if kwargs.get("stream"):
+        return scheduled_stream(create, priority, kwargs)
+    with scheduler.slot(kwargs["model"], priority):
+        if cassette:
+            return cassette.chat_completion(create, kwargs)
+        return create(**kwargs)
+
+def scheduled_stream(create, priority, kwargs):
+    # Streaming calls hold their slot until the last chunk has been read
+    with scheduler.slot(kwargs["model"], priority):
+        stream = cassette.chat_completion(create, kwargs) if cassette else create(**kwargs)
+        yield from stream
+
+def http_get(url, session=None, **kwargs):
+    get = (session or transport.session("default")).get
+    if cassette:
+        return cassette.http_get(get, url, kwargs)
+    return get(url, **kwargs)
+
+class CheckpointStore:
+    """Per-stage checkpoints in SQLite, so the GUI, command-line runs and workers can share one file."""
+
+    def __init__(self, path="checkpoints.db", max_runs=MAX_CHECKPOINT_RUNS, legacy_path="checkpoints.json"):
+        self.path = path
+        self.max_runs = max_runs
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    run_id TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    title TEXT,
+                    input_hash TEXT NOT NULL,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS checkpoint_stages (
+                    run_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    PRIMARY KEY (run_id, stage)
+                );
+            """)
+            # Checkpoint tables created before document runs
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(checkpoints)")]
+            if "document" not in columns:
+                conn.execute("ALTER TABLE checkpoints ADD COLUMN document TEXT")
+        if legacy_path:
+            self.import_legacy(legacy_path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return contextlib.closing(conn)
+
+    def import_legacy(self, path):
+        """Import runs from the old checkpoints.json once, while this store is still empty."""
+        if not os.path.exists(path):
+            return
+        with self.connect() as conn:
+            if conn.execute("SELECT 1 FROM checkpoints LIMIT 1").fetchone():
+                return
+            try:
+                with open(path, "r") as f:
+                    runs = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error loading checkpoints from {path}: {e}")
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for run_id, run in runs.items():
+                    conn.execute(
+                        "INSERT OR IGNORE INTO checkpoints "
+                        "(run_id, query, title, input_hash, completed, updated, document) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, run["query"], run.get("title"), run.get("input_hash", hash_text(run["query"])),
+                         int(run.get("completed", False)), run.get("updated", 0), run.get("document"))
+                    )
+                    for stage, checkpoint in run.get("stages", {}).items():
+                        conn.execute(
+                            "INSERT OR IGNORE INTO checkpoint_stages (run_id, stage, fingerprint, output) "
+                            "VALUES (?, ?, ?, ?)",
+                            (run_id, stage, checkpoint["fingerprint"], checkpoint["output"])
+                        )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logging.info(f"Imported {len(runs)} checkpointed runs from {path}.")
+
+    def start_run(self, run_id, user_query, title, document=None):
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO checkpoints (run_id, query, title, input_hash, updated, document) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (run_id) DO UPDATE SET completed = 0, updated = excluded.updated, "
+                    "document = COALESCE(excluded.document, document)",
+                    (run_id, user_query, title, hash_text(user_query), time.time(), document)
+                )
+                if self.max_runs:
+                    # Drop the oldest runs beyond the limit
+                    old = "SELECT run_id FROM checkpoints ORDER BY updated DESC LIMIT -1 OFFSET ?"
+                    conn.execute(f"DELETE FROM checkpoint_stages WHERE run_id IN ({old})", (self.max_runs,))
+                    conn.execute(f"DELETE FROM checkpoints WHERE run_id IN ({old})", (self.max_runs,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_run(self, run_id):
+        with self.connect() as conn:
+            row = conn.execute("SELECT query, title, document FROM checkpoints WHERE run_id = ?", (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def latest_run_id(self):
+        with self.connect() as conn:
+            row = conn.execute("SELECT run_id FROM checkpoints ORDER BY updated DESC LIMIT 1").fetchone()
+        return row["run_id"] if row else None
+
+    def load_stage(self, run_id, stage, fingerprint):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT output FROM checkpoint_stages WHERE run_id = ? AND stage = ? AND fingerprint = ?",
+                (run_id, stage, fingerprint)
+            ).fetchone()
+        return row["output"] if row else None
+
+    def save_stage(self, run_id, stage, fingerprint, output):
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoint_stages (run_id, stage, fingerprint, output) VALUES (?, ?, ?, ?)",
+                (run_id, stage, fingerprint, output)
+            )
+            conn.execute("UPDATE checkpoints SET updated = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def complete_run(self, run_id):
+        with self.connect() as conn:
+            conn.execute("UPDATE checkpoints SET completed = 1, updated = ? WHERE run_id = ?", (time.time(), run_id))
+
+# Each stored message body is compressed against up to this many earlier bodies in its session
+DELTA_BASES = 3
+# Longest chain of bases a body may depend on before it is stored standalone
+MAX_DELTA_DEPTH = 8
+# zlib only uses the last 32 KiB of a preset dictionary
+ZDICT_SIZE = 32768
+# Decompressed bodies kept for reuse as delta bases; enough for the recent messages of a few sessions
+BLOB_CACHE_SIZE = 256
+
+class SessionStore:
+    """Chat sessions kept as references into a compressed, content-addressed blob store.
+
+    Identical message bodies are stored once. New bodies are zlib-compressed with the
+    preceding messages of the session as a preset dictionary, so an agent output that
+    mostly repeats an earlier one (Echo and the user query, Courier and Critic) costs
+    little more than its differences.
+    """
+
+    def __init__(self, path="chat_history.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        # Least recently used first, so memory stays bounded however many messages are read
+        self.blob_cache = collections.OrderedDict()
+        self.blob_cache_lock = threading.Lock()
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    bases TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sessions (
+                    title TEXT PRIMARY KEY,
+                    created REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    session TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    blob TEXT NOT NULL,
+                    created REAL,
+                    PRIMARY KEY (session, seq)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return contextlib.closing(conn)
+
+    def read_blob(self, conn, blob_hash):
+        with self.blob_cache_lock:
+            text = self.blob_cache.get(blob_hash)
+            if text is not None:
+                self.blob_cache.move_to_end(blob_hash)
+                return text
+        row = conn.execute("SELECT bases, data FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+        zdict = self.preset_dictionary(conn, json.loads(row["bases"]))
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        text = (decompressor.decompress(row["data"]) + decompressor.flush()).decode("utf-8")
+        self.cache_blob(blob_hash, text)
+        return text
+
+    def cache_blob(self, blob_hash, text):
+        with self.blob_cache_lock:
+            self.blob_cache[blob_hash] = text
+            self.blob_cache.move_to_end(blob_hash)
+            while len(self.blob_cache) > BLOB_CACHE_SIZE:
+                self.blob_cache.popitem(last=False)
+
+    def preset_dictionary(self, conn, bases):
+        joined = "\n".join(self.read_blob(conn, base) for base in bases).encode("utf-8")
+        return joined[-ZDICT_SIZE:]
+
+    def write_blob(self, conn, text, bases):
+        blob_hash = hash_text(text)
+        if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (blob_hash,)).fetchone():
+            return blob_hash
+        depths = [conn.execute("SELECT depth FROM blobs WHERE hash = ?", (b,)).fetchone()["depth"] for b in bases]
+        if depths and max(depths) >= MAX_DELTA_DEPTH:
+            bases = []
+        zdict = self.preset_dictionary(conn, bases)
+        compressor = zlib.compressobj(9, zdict=zdict) if zdict else zlib.compressobj(9)
+        data = compressor.compress(text.encode("utf-8")) + compressor.flush()
+        conn.execute(
+            "INSERT INTO blobs (hash, bases, depth, data) VALUES (?, ?, ?, ?)",
+            (blob_hash, json.dumps(bases), 1 + max(depths, default=0) if bases else 0, data)
+        )
+        self.cache_blob(blob_hash, text)
+        return blob_hash
+
+    def insert_message(self, conn, title, role, message, created):
+        conn.execute("INSERT OR IGNORE INTO sessions (title, created) VALUES (?, ?)", (title, time.time()))
+        recent = conn.execute(
+            "SELECT seq, blob FROM messages WHERE session = ? ORDER BY seq DESC LIMIT ?",
+            (title, DELTA_BASES)
+        ).fetchall()
+        bases = list(dict.fromkeys(row["blob"] for row in reversed(recent)))
+        blob_hash = self.write_blob(conn, message, bases)
+        seq = recent[0]["seq"] + 1 if recent else 1
+        conn.execute(
+            "INSERT INTO messages (session, seq, role, blob, created) VALUES (?, ?, ?, ?, ?)",
+            (title, seq, role, blob_hash, created)
+        )
+
+    def append_message(self, title, role, message):
+        with self.lock, self.connect() as conn, conn:
+            self.insert_message(conn, title, role, message, time.time())
+
+    def session_titles(self):
+        with self.lock, self.connect() as conn:
+            return [row["title"] for row in conn.execute("SELECT title FROM sessions ORDER BY rowid")]
+
+    def load_session(self, title):
+        with self.lock, self.connect() as conn:
+            rows = conn.execute(
+                "SELECT role, blob FROM messages WHERE session = ? ORDER BY seq", (title,)
+            ).fetchall()
+            return [{"role": row["role"], "message": self.read_blob(conn, row["blob"])} for row in rows]
+
+    def session_messages(self, title):
+        with self.lock, self.connect() as conn:
+            rows = conn.execute(
+                "SELECT role, blob, created FROM messages WHERE session = ? ORDER BY seq", (title,)
+            ).fetchall()
+            return [
+                {"role": row["role"], "message": self.read_blob(conn, row["blob"]), "created": row["created"]}
+                for row in rows
+            ]
+
+    def clear(self):
+        with self.lock, self.connect() as conn, conn:
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM blobs")
+            with self.blob_cache_lock:
+                self.blob_cache.clear()
+        with self.connect() as conn:
+            conn.execute("VACUUM")
+
+    def import_legacy(self, path):
+        """Copy sessions from a chat_history.json file, once per store."""
+        with self.lock, self.connect() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return False
+        if not os.path.exists(path):
+            return False
+        with open(path, "r") as f:
+            sessions = json.load(f)
+        with self.lock, self.connect() as conn, conn:
+            for title, history in sessions.items():
+                for entry in history:
+                    # Legacy messages have no timestamp
+                    self.insert_message(conn, title, entry["role"], entry["message"], None)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', ?)", (path,))
+        logging.info(f"Imported {len(sessions)} chat sessions from {path}.")
+        return True
+
+EXPORT_FORMATS = {"json": ".json", "jsonl": ".jsonl", "markdown": ".md"}
+
+def parse_date(value, end_of_day=False):
+    """Parse YYYY-MM-DD or an ISO timestamp; a bare date as an upper bound covers the whole day."""
+    moment = datetime.datetime.fromisoformat(value)
+    if end_of_day and len(value) <= 10:
+        moment += datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
+    return moment.timestamp()
+
+def format_timestamp(created):
+    return datetime.datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S") if created else "unknown time"
+
+def export_sessions(store, path, fmt, since=None, until=None, titles=None, roles=None,
+                    progress=None, cancel_event=None):
+    """Stream sessions from the store to a file one at a time.
+
+    Writes to a temporary file that replaces `path` only when the export finishes.
+    Returns the number of sessions written, or None if cancelled.
+    """
+    selected = [title for title in store.session_titles() if not titles or title in titles]
+    tmp_path = f"{path}.tmp"
+    written = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if fmt == "json":
+            f.write("{")
+        for index, title in enumerate(selected):
+            if cancel_event and cancel_event.is_set():
+                break
+            messages = [
+                message for message in store.session_messages(title)
+                if (not roles or message["role"] in roles)
+                and (since is None or (message["created"] or 0) >= since)
+                and (until is None or (message["created"] or 0) <= until)
+            ]
+            if messages:
+                if fmt == "jsonl":
+                    f.write(json.dumps({"title": title, "messages": messages}) + "\n")
+                elif fmt == "markdown":
+                    f.write(f"# {title}\n\n")
+                    for message in messages:
+                        f.write(f"### {message['role']} ({format_timestamp(message['created'])})\n\n")
+                        f.write(f"{message['message']}\n\n")
+                else:
+                    # Same layout json.dump(..., indent=4) gives the whole history
+                    entries = [{"role": message["role"], "message": message["message"]} for message in messages]
+                    body = json.dumps({title: entries}, indent=4)[1:-2]
+                    f.write(("," if written else "") + body)
+                written += 1
+            if progress:
+                progress(index + 1, len(selected))
+        if fmt == "json":
+            f.write("\n}" if written else "}")
+    if cancel_event and cancel_event.is_set():
+        os.remove(tmp_path)
+        logging.info("Chat history export cancelled.")
+        return None
+    os.replace(tmp_path, path)
+    logging.info(f"Exported {written} chat sessions to {path}.")
+    return written
+
+class MultiAgentEngine:
+    def __init__(self, agent_profiles, google_api_key=None, search_engine_id=None,
+                 checkpoints=None, on_output=None, should_stop=None, priority="interactive"):
+        self.agent_profiles = agent_profiles
+        self.google_api_key = google_api_key
+        self.search_engine_id = search_engine_id
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.on_output = on_output
+        self.should_stop = should_stop or (lambda: stop_flag)
+        self.priority = priority
+        self.title = None
+        self.run_id = None
+        self.outputs = {}
+        self.deadline = None
+        self.stage_deadline = None
+        self.map_deadline = None
+        self.latency_estimates = {}
+        self.profile_overrides = {}
+        self.degraded = {}
+        # Stages whose output rests on failed or deadline-shortened I/O; never checkpointed
+        self.unsaved = set()
+        self.timed_out = False
+        self.stage_handlers = {
+            "Echo": self.agent_echo,
+            "Hermes": self.agent_hermes,
+            "Analyst": self.agent_analyst,
+            "Scribe": self.agent_scribe,
+            "Architect": self.agent_architect,
+            "Composer": self.agent_composer,
+            "Critic": self.agent_critic,
+            "Courier": self.agent_courier,
+        }
+
+    def profile(self, stage):
+        # The stage's profile with any deadline degradations applied
+        overrides = self.profile_overrides.get(stage)
+        return dict(self.agent_profiles[stage], **overrides) if overrides else self.agent_profiles[stage]
+
+    def complete(self, profile, messages, **kwargs):
+        client = get_openai_client(profile.get("base_url"), profile.get("api_key"))
+        if profile.get("max_tokens"):
+            kwargs.setdefault("max_tokens", profile["max_tokens"])
+        if self.deadline:
+            # A call may not outlive the budget; a timed-out stage leaves the best earlier output
+            kwargs.setdefault("timeout", max(1.0, self.deadline - time.monotonic()))
+        return chat_completion(client=client, priority=self.priority, model=profile["model"],
+                               messages=messages, **kwargs)
+
+    def emit(self, agent_name, content):
+        if self.on_output:
+            self.on_output(agent_name, content, self.title)
+
+    def plan_stage(self, index):
+        """Re-plan the remaining stages against the time left and apply the plan to the next one.
+
+        Returns False if the stage should be skipped.
+        """
+        stage = PIPELINE_STAGES[index][0]
+        remaining = [name for name, _ in PIPELINE_STAGES[index:]]
+        overrides, skipped, notes = plan_for_deadline(
+            self.agent_profiles, remaining, self.deadline - time.monotonic(), self.latency_estimates
+        )
+        # Later stages are planned again once their turn comes, with the time actually left
+        self.profile_overrides[stage] = overrides[stage]
+        later = sum(estimate_latency(name, dict(self.agent_profiles[name], **overrides[name]), self.latency_estimates)
+                    for name in remaining[1:] if name not in skipped)
+        # When this stage should be done to leave the later stages their estimated time
+        self.stage_deadline = self.deadline - later
+        if stage in notes:
+            self.degraded[stage] = notes[stage]
+            logging.info(f"Deadline: {stage} {', '.join(notes[stage])}.")
+        return stage not in skipped
+
+    def best_output(self):
+        for stage in BEST_OUTPUT_ORDER:
+            output = self.outputs.get(stage)
+            if output and not is_agent_error(stage, output):
+                return output
+        return None
+
+    def degradation_summary(self):
+        lines = [f"{stage} {', '.join(notes)}" for stage, notes in self.degraded.items()]
+        if self.timed_out:
+            lines.append("time ran out before the pipeline finished; showing the best output so far")
+        return "; ".join(lines)
+
+    def start_clock(self, deadline):
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.stage_deadline = None
+        self.latency_estimates = load_latency_estimates() if deadline else {}
+        self.profile_overrides = {}
+        self.degraded = {}
+        self.unsaved = set()
+        self.timed_out = False
+
+    def checkpointable(self, stage, output):
+        return not is_agent_error(stage, output) and stage not in self.degraded and stage not in self.unsaved
+
+    def run(self, user_query, title=None, run_id=None, deadline=None, seed=None, document=None,
+            clock_started=False):
+        """Run the pipeline, reusing every checkpointed stage that is still valid.
+
+        With a deadline in seconds, each stage is planned against the time left and
+        degraded as needed, and the best output so far is returned if time runs out;
+        clock_started means the caller already started the clock for work done first.
+        Stages given in seed use those outputs instead of running. Failed, degraded and
+        unsaved stages are never checkpointed. A document digest ties Hermes and Analyst to the document they
+        were mapped over; they cannot be rerun from the query alone.
+        Returns the Courier output, or None if processing was stopped or nothing
+        needed to be rerun. Every stage output is left in self.outputs.
+        """
+        run_id = self.run_id = run_id or uuid.uuid4().hex
+        self.title = title or ' '.join(user_query.split()[:8])
+        self.checkpoints.start_run(run_id, user_query, self.title, document)
+        logging.info(f"Starting run {run_id}.")
+        outputs = self.outputs = {"query": user_query}
+        if not clock_started:
+            self.start_clock(deadline)
+        ran_stage = False
+        for index, (stage, dependencies) in enumerate(PIPELINE_STAGES):
+            if self.should_stop():
+                logging.info(f"Processing stopped before {stage} agent.")
+                return None
+            inputs = [outputs[name] for name in dependencies]
+            document_stage = document and stage in DOCUMENT_STAGES
+            fingerprint = stage_fingerprint(self.agent_profiles[stage], inputs + [document] if document_stage else inputs)
+            if seed and stage in seed:
+                outputs[stage] = seed[stage]
+                if self.checkpointable(stage, seed[stage]):
+                    self.checkpoints.save_stage(run_id, stage, fingerprint, seed[stage])
+                ran_stage = True
+                continue
+            output = self.checkpoints.load_stage(run_id, stage, fingerprint)
+            if output is None and document_stage:
+                raise ValueError(f"Agent {stage} of this run analysed a document and its checkpoint is no "
+                                 f"longer valid. Ingest the document again to rerun it.")
+            if output is None and self.deadline:
+                if time.monotonic() >= self.deadline:
+                    self.timed_out = True
+                    break
+                if not self.plan_stage(index):
+                    # Skipped stages pass their input through and are never checkpointed
+                    outputs[stage] = inputs[-1]
+                    continue
+                fingerprint = stage_fingerprint(self.profile(stage), inputs)
+                output = self.checkpoints.load_stage(run_id, stage, fingerprint)
+            if output is not None:
+                logging.info(f"Agent {stage} restored from checkpoint.")
+            else:
+                output = self.run_stage(stage, inputs)
+                ran_stage = True
+                # Failed and degraded stages are not checkpointed so a resume retries them
+                if self.checkpointable(stage, output):
+                    self.checkpoints.save_stage(run_id, stage, fingerprint, output)
+                elif is_agent_error(stage, output) and self.deadline and time.monotonic() >= self.deadline:
+                    self.timed_out = True
+                    break
+            outputs[stage] = output
+        record_metric(run_id=run_id, stage="transport", endpoints=transport.stats())
+        if self.degraded or self.timed_out:
+            summary = self.degradation_summary()
+            logging.info(f"Deadline degradations for run {run_id}: {summary}")
+            self.emit("Deadline", f"Degraded to meet the {deadline:g}s budget: {summary}")
+            record_metric(run_id=run_id, stage="deadline", budget=deadline, degraded=self.degraded,
+                          timed_out=self.timed_out)
+        if self.timed_out:
+            logging.info(f"Run {run_id} ran out of time; it can be resumed to finish.")
+            return self.best_output()
+        self.checkpoints.complete_run(run_id)
+        if not ran_stage:
+            logging.info(f"Run {run_id} is already complete; nothing to resume.")
+            return None
+        return outputs["Courier"]
+
+    def run_stage(self, stage, inputs):
+        profile = self.profile(stage)
+        local = profile.get("type") == "local" and stage in LOCAL_AGENTS
+        started = time.perf_counter()
+        output = self.run_local_agent(stage, inputs) if local else self.stage_handlers[stage](*inputs)
+        # Feeds the latency estimates deadline runs plan against
+        record_metric(run_id=self.run_id, stage=stage, model="local" if local else profile.get("model"),
+                      latency=time.perf_counter() - started, error=is_agent_error(stage, output))
+        return output
+
+    def run_local_agent(self, stage, inputs):
+        try:
+            output = LOCAL_AGENTS[stage](*inputs)
+            self.emit(stage, output)
+            logging.info(f"Local agent {stage} processed successfully.")
+            return output
+        except Exception as e:
+            logging.error(f"Error in Agent {stage}: {e}")
+            return f"Error in Agent {stage}: {e}"
+
+    def resume(self, run_id=None, deadline=None):
+        run_id = run_id or self.checkpoints.latest_run_id()
+        run = self.checkpoints.get_run(run_id) if run_id else None
+        if not run:
+            raise ValueError("No checkpointed run to resume.")
+        logging.info(f"Resuming run {run_id}.")
+        return self.run(run["query"], run["title"], run_id, deadline, document=run.get("document"))
+
+    def run_document(self, source, instruction=None, title=None, deadline=None):
+        """Run the pipeline over a long document read from a text file object.
+
+        Hermes and Analyst are mapped over the document's chunks concurrently and their
+        partial outputs are reduced pairwise before Architect. Only the chunks in flight
+        and the partials waiting for a sibling are held in memory, however long the document.
+        A deadline covers the whole run: mapping stops early enough to leave the later
+        stages their fastest estimated time. Raises ValueError if the document cannot be
+        analysed. Returns the Courier output, or None if processing was stopped.
+        """
+        instruction = instruction or DOCUMENT_DEFAULT_INSTRUCTION
+        self.run_id = uuid.uuid4().hex
+        self.title = title or ' '.join(instruction.split()[:8])
+        self.start_clock(deadline)
+        self.map_deadline = None
+        if self.deadline:
+            later = [stage for stage, _ in PIPELINE_STAGES if stage not in DOCUMENT_STAGES + ("Echo",)]
+            overrides, skipped, _ = plan_for_deadline(self.agent_profiles, later, 0, self.latency_estimates)
+            self.map_deadline = self.deadline - sum(
+                estimate_latency(stage, dict(self.agent_profiles[stage], **overrides[stage]), self.latency_estimates)
+                for stage in later if stage not in skipped
+            )
+        echo_output = self.run_stage("Echo", [instruction])
+        if is_agent_error("Echo", echo_output):
+            raise ValueError(echo_output)
+        result = self.map_reduce_document(echo_output, iter_document_chunks(source))
+        if result is None:
+            return None
+        (hermes_output, analyst_output), document = result
+        self.emit("Hermes", hermes_output)
+        self.emit("Analyst", analyst_output)
+        return self.run(instruction, self.title, self.run_id, deadline,
+                        seed={"Echo": echo_output, "Hermes": hermes_output, "Analyst": analyst_output},
+                        document=document, clock_started=True)
+
+    def map_reduce_document(self, instruction, chunks):
+        """Map Hermes and Analyst over the chunks and reduce the results.
+
+        Returns ((Hermes output, Analyst output), document digest), or None if stopped.
+        """
+        started = time.perf_counter()
+        reducer = HierarchicalReducer(self.merge_partials)
+        digest = hashlib.sha256()
+        count = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=DOCUMENT_MAX_PARALLEL) as executor:
+                in_flight = set()
+                for index, chunk in enumerate(chunks):
+                    if self.should_stop():
+                        logging.info("Processing stopped while reading the document.")
+                        return None
+                    if count and self.map_deadline and time.monotonic() >= self.map_deadline:
+                        note = f"analysed only the first {count} parts of the document"
+                        self.degraded["Hermes"], self.degraded["Analyst"] = [note], [note]
+                        logging.info(f"Deadline: {note}.")
+                        break
+                    # Wait for a free slot before reading further, so memory does not grow with length
+                    if len(in_flight) >= DOCUMENT_MAX_PARALLEL:
+                        done, in_flight = concurrent.futures.wait(
+                            in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            future.result()
+                    digest.update(chunk.encode("utf-8"))
+                    in_flight.add(executor.submit(self.map_chunk, reducer, instruction, index, chunk))
+                    count += 1
+                for future in concurrent.futures.as_completed(in_flight):
+                    future.result()
+            if not count:
+                raise ValueError("the document is empty")
+            partial = reducer.result()
+        except Exception as e:
+            logging.error(f"Error analysing document: {e}")
+            raise ValueError(f"Document analysis failed: {e}") from e
+        record_metric(run_id=self.run_id, stage="document", chunks=count, merges=reducer.merges,
+                      latency=time.perf_counter() - started)
+        logging.info(f"Mapped {count} document chunks and merged them in {reducer.merges} steps.")
+        return partial, digest.hexdigest()
+
+    def map_chunk(self, reducer, instruction, index, chunk):
+        if self.should_stop():
+            return
+        prompt = DOCUMENT_CHUNK_PROMPT.format(instruction=instruction, number=index + 1, chunk=chunk)
+        hermes_output = self.document_call("Hermes", prompt)
+        analyst_output = self.document_call("Analyst", hermes_output)
+        logging.info(f"Document chunk {index + 1} analysed.")
+        reducer.add(index, (hermes_output, analyst_output))
+
+    def merge_partials(self, left, right):
+        # Each partial is a (Hermes output, Analyst output) pair
+        return (self.merge_outputs("Hermes", left[0], right[0]),
+                self.merge_outputs("Analyst", left[1], right[1]))
+
+    def merge_outputs(self, stage, first, second):
+        if self.map_deadline and time.monotonic() >= self.map_deadline:
+            # Out of time for another model call; keep both parts as they are
+            notes = self.degraded.setdefault(stage, [])
+            if "joined some parts without merging" not in notes:
+                notes.append("joined some parts without merging")
+            return f"{first}\n\n{second}"
+        return self.document_call(stage, f"First part:\n{first}\n\nSecond part:\n{second}",
+                                  DOCUMENT_MERGE_INSTRUCTIONS)
+
+    def document_call(self, stage, content, instructions=""):
+        profile = self.profile(stage)
+        try:
+            response = self.complete(profile, [
+                {"role": "system", "content": profile["system_prompt"] + instructions},
+                {"role": "user", "content": content}
+            ])
+        except Exception as e:
+            raise RuntimeError(f"Agent {stage}: {e}") from e
+        return response.choices[0].message.content.strip()
+
+    def agent_echo(self, user_query):
+        try:
+            profile = self.profile("Echo")
+            response = self.complete(profile, [
+                {"role": "system", "content": profile["system_prompt"]},
+                {"role": "user", "content": user_query}
+            ])
+            echo_output = response.choices[0].message.content.strip()
+            self.emit("Echo", echo_output)
+            logging.info("Agent Echo processed successfully.")
+            return echo_output
+        except Exception as e:
+            logging.error(f"Error in Agent Echo: {e}")
+            return f"Error in Agent Echo: {e}"
+
+    def agent_hermes(self, echo_output):
+        try:
+            profile = self.profile("Hermes")
+            response = self.complete(profile, [
+                {"role": "system", "content": profile["system_prompt"]},
+                {"role": "user", "content": echo_output}
+            ])
+            hermes_output = response.choices[0].message.content.strip()
+            self.emit("Hermes", hermes_output)
+            logging.info("Agent Hermes processed successfully.")
+            return hermes_output
+        except Exception as e:
+            logging.error(f"Error in Agent Hermes: {e}")
+            return f"Error in Agent Hermes: {e}"
+
+    def agent_analyst(self, hermes_output):
+        try:
+            profile = self.profile("Analyst")
+            response = self.complete(profile, [
+                {"role": "system", "content": profile["system_prompt"]},
+                {"role": "user", "content": hermes_output}
+            ])
+            analyst_output = response.choices[0].message.content.strip()
+            self.emit("Analyst", analyst_output)
+            logging.info("Agent Analyst processed successfully.")
+            return analyst_output
+        except Exception as e:
+            logging.error(f"Error in Agent Analyst: {e}")
+            return f"Error in Agent Analyst: {e}"
+
+    def agent_scribe(self, analyst_output):
+        try:
+            profile = self.profile("Scribe")
+            search_query = analyst_output  # Assuming this is appropriate
+            fetch_pages = profile.get("fetch_pages", False)
+            io_deadline = None
+            if self.deadline:
+                # Search and page fetches get half of Scribe's share; its model call needs the rest
+                io_deadline = time.monotonic() + max(0.0, self.stage_deadline - time.monotonic()) / 2
+                if fetch_pages and io_deadline - time.monotonic() < PAGE_DEADLINE / 2:
+                    fetch_pages = False
+                    self.degraded.setdefault("Scribe", []).append("skipped page fetching")
+                elif fetch_pages and io_deadline < time.monotonic() + PAGE_DEADLINE:
+                    # Fewer pages may load in the shortened time than a full run would read
+                    self.unsaved.add("Scribe")
+            search_result = get_search_result(
+                search_query, self.google_api_key, self.search_engine_id,
+                fetch_pages=fetch_pages, deadline=io_deadline
+            )
+            if search_result.startswith("Error"):
+                # Answered without search results; a resume should search again
+                self.unsaved.add("Scribe")
+            response = self.complete(profile, [
+                {"role": "system", "content": profile["system_prompt"]},
+                {"role": "user", "content": search_result}
+            ])
+            scribe_output = response.choices[0].message.content.strip()
+            self.emit("Scribe", scribe_output)
+            logging.info("Agent Scribe processed successfully.")
+            return scribe_output
+        except Exception as e:
+            logging.error(f"Error in Agent Scribe: {e}")
+            return f"Error in Agent Scribe: {e}"
+
+    def agent_architect(self, echo_output, hermes_output, analyst_output, scribe_output):
+        try:
+           profile = self.profile("Architect")
+           combined_input = (
+                f"Echo Output:\n{echo_output}\n\n"
+                f"Hermes Output:\n{hermes_output}\n\n"
+                f"Analyst Output:\n{analyst_output}\n\n"
+                f"Scribe Output:\n{scribe_output}"
+            )
+           response = self.complete(profile, [
+               {"role": "system", "content": profile["system_prompt"]},
+               {"role": "user", "content": combined_input}
+           ])
+           architect_output = response.choices[0].message.content.strip()
+           self.emit("Architect", architect_output)
+           logging.info("Agent Architect processed successfully.")
+           return architect_output
+        except Exception as e:
+            logging.error(f"Error in Agent Architect: {e}")
+            return f"Error in Agent Architect: {e}"
+
+    def compose_section(self, profile, architect_output, analyst_output, scribe_output, index, sections):
+        title, details = sections[index]
+        section_input = (
+            f"Architect Output:\n{architect_output}\n\n"
+            f"Analyst Output:\n{analyst_output}\n\n"
+            f"Scribe Output:\n{scribe_output}\n\n"
+            f"Your Section ({index + 1} of {len(sections)}): {title}\n{details}"
+        )
+        response = self.complete(profile, [
+            {"role": "system", "content": profile["system_prompt"] + COMPOSER_SECTION_INSTRUCTIONS},
+            {"role": "user", "content": section_input}
+        ])
+        return response.choices[0].message.content.strip()
+
+    def stitch_sections(self, profile, texts):
+        boundaries = "\n\n".join(
+            f"Boundary {i + 1}:\nEnd of section:\n{last_paragraph(texts[i])}\n"
+            f"Start of next section:\n{first_paragraph(texts[i + 1])}"
+            for i in range(len(texts) - 1)
+        )
+        try:
+            response = self.complete(profile, [
+                {"role": "system", "content": COMPOSER_STITCH_PROMPT},
+                {"role": "user", "content": boundaries}
+            ])
+            transitions = parse_json_reply(response.choices[0].message.content).get("transitions", [])
+            if len(transitions) != len(texts) - 1 or not all(isinstance(t, str) for t in transitions):
+                raise ValueError("Transition count does not match the section boundaries.")
+        except Exception as e:
+            logging.warning(f"Composer stitching failed, joining sections as written: {e}")
+            return "\n\n".join(texts)
+        return "\n\n".join(
+            text + (f"\n\n{transitions[i]}" if i < len(transitions) and transitions[i].strip() else "")
+            for i, text in enumerate(texts)
+        )
+
+    def compose_sections(self, profile, architect_output, analyst_output, scribe_output):
+        """Write each section of the Architect's plan concurrently, then stitch them together.
+
+        Returns None if the plan has no usable sections or a section fails, so the
+        caller can fall back to composing the whole response in one call.
+        """
+        sections = parse_plan_sections(architect_output)
+        if not sections:
+            logging.info("Architect plan has no sections to compose in parallel.")
+            return None
+        started = time.perf_counter()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(sections), COMPOSER_MAX_PARALLEL)) as pool:
+                texts = list(pool.map(
+                    lambda index: self.compose_section(
+                        profile, architect_output, analyst_output, scribe_output, index, sections
+                    ),
+                    range(len(sections))
+                ))
+        except Exception as e:
+            logging.warning(f"Composing sections in parallel failed, composing in one call: {e}")
+            return None
+        composer_output = self.stitch_sections(profile, texts) if profile.get("stitch", True) else "\n\n".join(texts)
+        record_metric(run_id=self.run_id, stage="Composer", mode="sections", sections=len(sections),
+                      latency=time.perf_counter() - started)
+        logging.info(f"Composer wrote {len(sections)} sections in parallel.")
+        return composer_output
+
+    def agent_composer(self, architect_output, analyst_output, scribe_output):
+        try:
+            profile = self.profile("Composer")
+            composer_output = None
+            if profile.get("mode") == "sections":
+                composer_output = self.compose_sections(profile, architect_output, analyst_output, scribe_output)
+            if composer_output is None:
+                combined_input = (
+                    f"Architect Output:\n{architect_output}\n\n"
+                    f"Analyst Output:\n{analyst_output}\n\n"
+                    f"Scribe Output:\n{scribe_output}"
+                )
+                response = self.complete(profile, [
+                    {"role": "system", "content": profile["system_prompt"]},
+                    {"role": "user", "content": combined_input}
+                ])
+                composer_output = response.choices[0].message.content.strip()
+            self.emit("Composer", composer_output)
+            logging.info("Agent Composer processed successfully.")
+            return composer_output
+        except Exception as e:
+            logging.error(f"Error in Agent Composer: {e}")
+            return f"Error in Agent Composer: {e}"
+
+    def critic_edits(self, profile, composer_output):
+        """Ask the Critic for span replacements and apply them locally.
+
+        Returns None if the reply cannot be parsed or applied, so the caller can
+        fall back to a full rewrite.
+        """
+        response = self.complete(profile, [
+            {"role": "system", "content": profile["system_prompt"] + CRITIC_EDITS_INSTRUCTIONS},
+            {"role": "user", "content": composer_output}
+        ])
+        reply = response.choices[0].message.content.strip()
+        usage = getattr(response, "usage", None)
+        output_tokens = usage.completion_tokens if usage else estimate_tokens(reply)
+        try:
+            edits = parse_json_reply(reply).get("edits", [])
+            critic_output = apply_edits(composer_output, edits)
+        except (ValueError, AttributeError) as e:
+            logging.warning(f"Critic edits could not be applied, falling back to a full rewrite: {e}")
+            record_metric(run_id=self.run_id, stage="Critic", mode="edits", fallback=True,
+                          output_tokens=output_tokens)
+            return None
+        # A full rewrite would have emitted roughly the whole revised text
+        rewrite_tokens = estimate_tokens(critic_output)
+        record_metric(run_id=self.run_id, stage="Critic", mode="edits", fallback=False, edits=len(edits),
+                      output_tokens=output_tokens, output_tokens_saved=max(0, rewrite_tokens - output_tokens))
+        logging.info(f"Critic applied {len(edits)} edits using {output_tokens} output tokens "
+                     f"instead of about {rewrite_tokens}.")
+        return critic_output
+
+    def agent_critic(self, composer_output):
+        try:
+            profile = self.profile("Critic")
+            critic_output = None
+            if profile.get("mode") == "edits":
+                critic_output = self.critic_edits(profile, composer_output)
+            if critic_output is None:
+                response = self.complete(profile, [
+                    {"role": "system", "content": profile["system_prompt"]},
+                    {"role": "user", "content": composer_output}
+                ])
+                critic_output = response.choices[0].message.content.strip()
+            self.emit("Critic", critic_output)
+            logging.info("Agent Critic processed successfully.")
+            return critic_output
+        except Exception as e:
+            logging.error(f"Error in Agent Critic: {e}")
+            return f"Error in Agent Critic: {e}"
+
+    def agent_courier(self, critic_output):
+        try:
+            profile = self.profile("Courier")
+            response = self.complete(profile, [
+                {"role": "system", "content": profile["system_prompt"]},
+                {"role": "user", "content": critic_output}
+            ])
+            courier_output = response.choices[0].message.content.strip()
+            self.emit("Courier", courier_output)
+            logging.info("Agent Courier processed successfully.")
+            return courier_output
+        except Exception as e:
+            logging.error(f"Error in Agent Courier: {e}")
+            return f"Error in Agent Courier: {e}"
+
 class MultiAgentApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -161,16 +2297,21 @@ class MultiAgentApp(tk.Tk):
 
         self.agent_profiles_file = "agent_profiles.json"
         self.chat_history_file = "chat_history.json"
+        self.session_store = SessionStore("chat_history.db")
         self.config_file = "config.env"
 
         self.agent_profiles = AGENT_PROFILES.copy()
-        self.chat_sessions = {}
+        # Messages stay in the session store until a session is opened
+        self.session_titles = []
+        self.checkpoints = CheckpointStore()
         self.api_key = None
         self.google_api_key = None
         self.search_engine_id = None
+        self.config = {}
 
         self.load_config()
         self.load_agent_profiles()
+        configure_transport(self.config, self.agent_profiles)
         self.create_menu()
         self.create_widgets()
         self.load_chat_history()
@@ -178,16 +2319,11 @@ class MultiAgentApp(tk.Tk):
     def load_config(self):
         # Load from config.env
         if os.path.exists(self.config_file):
-            with open(self.config_file, "r") as f:
-                for line in f:
-                    if '=' in line:
-                        key, value = line.strip().split('=', 1)
-                        if key == "OPENAI_API_KEY":
-                            self.api_key = value
-                        elif key == "GOOGLE_API_KEY":
-                            self.google_api_key = value
-                        elif key == "SEARCH_ENGINE_ID":
-                            self.search_engine_id = value
+            config = self.config = read_config(self.config_file)
+            self.api_key = config.get("OPENAI_API_KEY")
+            self.google_api_key = config.get("GOOGLE_API_KEY")
+            self.search_engine_id = config.get("SEARCH_ENGINE_ID")
+            configure_scheduler(config)
             if self.api_key:
                 # Set OpenAI API key
                 openai.api_key = self.api_key
@@ -198,12 +2334,7 @@ class MultiAgentApp(tk.Tk):
             logging.info("No config.env file found.")
 
     def load_agent_profiles(self):
-        if os.path.exists(self.agent_profiles_file):
-            with open(self.agent_profiles_file, "r") as f:
-                self.agent_profiles = json.load(f)
-            logging.info("Agent profiles loaded from file.")
-        else:
-            logging.info("No agent profiles file found. Using default profiles.")
+        self.agent_profiles = read_agent_profiles(self.agent_profiles_file)
 
     def save_agent_profiles(self):
         with open(self.agent_profiles_file, "w") as f:
@@ -211,21 +2342,22 @@ class MultiAgentApp(tk.Tk):
         logging.info("Agent profiles saved to file.")
 
     def load_chat_history(self):
-        if os.path.exists(self.chat_history_file):
-            with open(self.chat_history_file, "r") as f:
-                self.chat_sessions = json.load(f)
-            logging.info("Chat sessions loaded.")
-            # Populate the chat history listbox
-            self.history_listbox.delete(0, tk.END)
-            for title in self.chat_sessions.keys():
-                self.history_listbox.insert(tk.END, title)
-        else:
-            logging.info("No chat history file found.")
+        # Sessions from the old chat_history.json are copied into the store on first run
+        self.session_store.import_legacy(self.chat_history_file)
+        self.session_titles = self.session_store.session_titles()
+        logging.info("Chat sessions loaded.")
+        # Populate the chat history listbox
+        self.history_listbox.delete(0, tk.END)
+        for title in self.session_titles:
+            self.history_listbox.insert(tk.END, title)
+
+    def add_session(self, title):
+        if title not in self.session_titles:
+            self.session_titles.append(title)
+            self.history_listbox.insert(tk.END, title)
 
-    def save_chat_sessions(self):
-        with open(self.chat_history_file, "w") as f:
-            json.dump(self.chat_sessions, f, indent=4)
-        logging.info("Chat sessions saved.")
+    def save_message(self, title, role, message):
+        self.session_store.append_message(title, role, message)
 
     def create_menu(self):
         menubar = tk.Menu(self)
@@ -237,6 +2369,7 @@ class MultiAgentApp(tk.Tk):
         file_menu.add_separator()
         file_menu.add_command(label="New Session", command=self.start_new_session)
         file_menu.add_command(label="Export Chat", command=self.export_chat_history)
+        file_menu.add_command(label="Ingest Document...", command=self.ingest_document)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.quit)
         menubar.add_cascade(label="File", menu=file_menu)
@@ -258,7 +2391,7 @@ class MultiAgentApp(tk.Tk):
         history_label = ttk.Label(history_frame, text="Chat History:")
         history_label.pack(anchor="w")
 
-        self.history_listbox = tk.Listbox(history_frame, width=30)
+        self.history_listbox = tk.Listbox(history_frame, width=30, selectmode=tk.EXTENDED)
         self.history_listbox.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
         self.history_listbox.bind('<Double-Button-1>', self.open_chat_session)
 
@@ -285,13 +2418,26 @@ class MultiAgentApp(tk.Tk):
         stop_button = ttk.Button(input_frame, text="Stop", command=self.stop_processing)
         stop_button.pack(side=tk.RIGHT, padx=(0, 10))
 
+        # Resume continues the latest run from its first incomplete or invalidated stage
+        resume_button = ttk.Button(input_frame, text="Resume", command=self.resume_query)
+        resume_button.pack(side=tk.RIGHT, padx=(0, 10))
+
         send_button = ttk.Button(input_frame, text="Send", command=self.submit_query)
         send_button.pack(side=tk.RIGHT)
 
+        # Optional latency budget; leave empty to run every stage at full quality
+        self.deadline_spinbox = ttk.Spinbox(input_frame, from_=0, to=600, increment=5, width=5)
+        self.deadline_spinbox.pack(side=tk.RIGHT, padx=(0, 10))
+        ttk.Label(input_frame, text="Answer within (s):").pack(side=tk.RIGHT, padx=(0, 5))
+
         # Progress bar
         self.progress = ttk.Progressbar(self, mode='indeterminate')
         self.progress.pack(fill=tk.X, padx=10, pady=(0, 10))
 
+        # Lists the stages a deadline run had to degrade
+        self.status_label = ttk.Label(self, text="", foreground="gray")
+        self.status_label.pack(fill=tk.X, padx=10, pady=(0, 10))
+
     def open_settings(self):
         SettingsDialog(self)
 
@@ -307,489 +2453,186 @@ class MultiAgentApp(tk.Tk):
     def start_new_session(self):
         global stop_flag
         stop_flag = False
-        self.chat_sessions = {}
+        self.session_titles = []
         self.history_listbox.delete(0, tk.END)
         self.conversation_text.configure(state='normal')
         self.conversation_text.delete(1.0, tk.END)
         self.conversation_text.configure(state='disabled')
-        self.save_chat_sessions()
+        self.session_store.clear()
         logging.info("Started a new session.")
 
     def export_chat_history(self):
-        file_path = filedialog.asksaveasfilename(
-            title="Export Chat History",
-            defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
-        )
-        if file_path:
-            with open(file_path, "w") as f:
-                json.dump(self.chat_sessions, f, indent=4)
-            messagebox.showinfo("Export Successful", f"Chat history exported to {file_path}.")
+        selected_titles = [self.history_listbox.get(index) for index in self.history_listbox.curselection()]
+        ExportDialog(self, selected_titles)
 
-    def submit_query(self, event=None):
-        user_query = self.user_input.get().strip()
-        if not user_query:
-            messagebox.showwarning("No Input", "Please enter a query to submit.")
+    def ingest_document(self):
+        DocumentDialog(self)
+
+    def submit_document(self, instruction, open_source, name):
+        deadline = self.get_deadline()
+        if deadline is False:
             return
-        self.user_input.delete(0, tk.END)
-        # Generate title
-        title = ' '.join(user_query.split()[:8])
-        if title not in self.chat_sessions:
-            self.chat_sessions[title] = []
-            self.history_listbox.insert(tk.END, title)
-        # Add user message to conversation
-        self.chat_sessions[title].append({"role": "User", "message": user_query})
-        self.update_conversation_display(title, "User", user_query)
+        instruction = instruction or DOCUMENT_DEFAULT_INSTRUCTION
+        title = ' '.join(instruction.split()[:8])
+        self.add_session(title)
+        user_message = f"{instruction}\n[Document: {name}]"
+        self.save_message(title, "User", user_message)
+        self.update_conversation_display(title, "User", user_message)
 
-        # Start processing in a new thread
         global stop_flag
         stop_flag = False
         self.progress.start()
-        query_thread = threading.Thread(target=self.process_query, args=(title, user_query))
+        query_thread = threading.Thread(
+            target=self.process_document, args=(title, instruction, open_source, deadline)
+        )
         query_thread.start()
 
-    def add_conversation(self, agent_name, content):
-        self.conversation_text.configure(state='normal')
-        self.conversation_text.insert(tk.END, f"{agent_name}: {content}\n\n")
-        self.conversation_text.see(tk.END)
-        self.conversation_text.configure(state='disabled')
-        # Find current session title
-        current_sessions = list(self.chat_sessions.keys())
-        if not current_sessions:
-            return
-        current_title = current_sessions[-1]
-        # Add to chat session
-        self.chat_sessions[current_title].append({"role": agent_name, "message": content})
-        self.save_chat_sessions()
-
-    def update_conversation_display(self, title, role, message):
-        self.conversation_text.configure(state='normal')
-        self.conversation_text.insert(tk.END, f"{role}: {message}\n\n")
-        self.conversation_text.configure(state='disabled')
-        self.conversation_text.see(tk.END)
-
-    def process_query(self, title, user_query):
-        global stop_flag
-        try:
-            # Echo Agent
-            if stop_flag:
-                logging.info("Processing stopped before Echo agent.")
-                return
-            echo = self.agent_echo(user_query)
-        
-            # Hermes Agent
-            if stop_flag:
-                logging.info("Processing stopped before Hermes agent.")
-                return
-            hermes = self.agent_hermes(echo)
-        
-            # Analyst Agent
-            if stop_flag:
-                logging.info("Processing stopped before Analyst agent.")
-                return
-            analyst = self.agent_analyst(hermes)
-        
-            # Scribe Agent
-            if stop_flag:
-                logging.info("Processing stopped before Scribe agent.")
-                return
-            scribe = self.agent_scribe(analyst)
-        
-            # Architect Agent
-            if stop_flag:
-                logging.info("Processing stopped before Architect agent.")
-                return
-            architect = self.agent_architect(echo, hermes, analyst, scribe)
-        
-            # Composer Agent
-            if stop_flag:
-                logging.info("Processing stopped before Composer agent.")
-                return
-            composer = self.agent_composer(architect, analyst, scribe)
-        
-            # Critic Agent
-            if stop_flag:
-                logging.info("Processing stopped before Critic agent.")
-                return
-            critic = self.agent_critic(composer)
-        
-            # Courier Agent
-            if stop_flag:
-                logging.info("Processing stopped before Courier agent.")
-                return
-            courier = self.agent_courier(critic)
-        
-            # Add final output to the conversation
-            self.add_conversation("User", courier)
-            logging.info("All agents processed successfully.")
-        except Exception as e:
-            logging.error(f"Error processing query: {e}")
-            messagebox.showerror("Processing Error", f"An error occurred: {e}")
-        finally:
-            self.progress.stop()
-
-    def agent_echo(self, user_query):
-        try:
-            profile = self.agent_profiles["Echo"]
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": user_query}
-                ]
-            )
-            echo_output = response.choices[0].message.content.strip()
-            self.add_conversation("Echo", echo_output)
-            logging.info("Agent Echo processed successfully.")
-            return echo_output
-        except Exception as e:
-            logging.error(f"Error in Agent Echo: {e}")
-            return f"Error in Agent Echo: {e}"
-
-    def agent_hermes(self, echo_output):
-        try:
-            profile = self.agent_profiles["Hermes"]
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": echo_output}
-                ]
-            )
-            hermes_output = response.choices[0].message.content.strip()
-            self.add_conversation("Hermes", hermes_output)
-            logging.info("Agent Hermes processed successfully.")
-            return hermes_output
-        except Exception as e:
-            logging.error(f"Error in Agent Hermes: {e}")
-            return f"Error in Agent Hermes: {e}"
-
-    def agent_analyst(self, hermes_output):
-        try:
-            profile = self.agent_profiles["Analyst"]
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": hermes_output}
-                ]
-            )
-            analyst_output = response.choices[0].message.content.strip()
-            self.add_conversation("Analyst", analyst_output)
-            logging.info("Agent Analyst processed successfully.")
-            return analyst_output
-        except Exception as e:
-            logging.error(f"Error in Agent Analyst: {e}")
-            return f"Error in Agent Analyst: {e}"
-
-    def agent_scribe(self, analyst_output):
-        try:
-            profile = self.agent_profiles["Scribe"]
-            search_query = analyst_output  # Assuming this is appropriate
-            search_result = get_search_result(search_query, self.google_api_key, self.search_engine_id)
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": search_result}
-                ]
-            )
-            scribe_output = response.choices[0].message.content.strip()
-            self.add_conversation("Scribe", scribe_output)
-            logging.info("Agent Scribe processed successfully.")
-            return scribe_output
-        except Exception as e:
-            logging.error(f"Error in Agent Scribe: {e}")
-            return f"Error in Agent Scribe: {e}"
-
-    def agent_architect(self, echo_output, hermes_output, analyst_output, scribe_output):
-        try:
-           profile = self.agent_profiles["Architect"]
-           combined_input = (
-                f"Echo Output:\n{echo_output}\n\n"
-                f"Hermes Output:\n{hermes_output}\n\n"
-                f"Analyst Output:\n{analyst_output}\n\n"
-                f"Scribe Output:\n{scribe_output}"
-            )
-           response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": combined_input}
-                ]
-            )
-           architect_output = response.choices[0].message.content.strip()
-           self.add_conversation("Architect", architect_output)
-           logging.info("Agent Architect processed successfully.")
-           return architect_output
-        except Exception as e:
-            logging.error(f"Error in Agent Architect: {e}")
-            return f"Error in Agent Architect: {e}"
-
-    def agent_composer(self, architect_output, analyst_output, scribe_output):
-        try:
-            profile = self.agent_profiles["Composer"]
-            combined_input = (
-                f"Architect Output:\n{architect_output}\n\n"
-                f"Analyst Output:\n{analyst_output}\n\n"
-                f"Scribe Output:\n{scribe_output}"
-            )
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": combined_input}
-                ]
-            )
-            composer_output = response.choices[0].message.content.strip()
-            self.add_conversation("Composer", composer_output)
-            logging.info("Agent Composer processed successfully.")
-            return composer_output
-        except Exception as e:
-            logging.error(f"Error in Agent Composer: {e}")
-            return f"Error in Agent Composer: {e}"
-
-    def agent_critic(self, composer_output):
-        try:
-            profile = self.agent_profiles["Critic"]
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": composer_output}
-                ]
-            )
-            critic_output = response.choices[0].message.content.strip()
-            self.add_conversation("Critic", critic_output)
-            logging.info("Agent Critic processed successfully.")
-            return critic_output
-        except Exception as e:
-            logging.error(f"Error in Agent Critic: {e}")
-            return f"Error in Agent Critic: {e}"
-
-    def agent_courier(self, critic_output):
-        try:
-            profile = self.agent_profiles["Courier"]
-            response = openai.chat.completions.create(
-                model=profile["model"],
-                messages=[
-                    {"role": "system", "content": profile["system_prompt"]},
-                    {"role": "user", "content": critic_output}
-                ]
-            )
-            courier_output = response.choices[0].message.content.strip()
-            self.add_conversation("Courier", courier_output)
-            logging.info("Agent Courier processed successfully.")
-            return courier_output
-        except Exception as e:
-            logging.error(f"Error in Agent Courier: {e}")
-            return f"Error in Agent Courier: {e}"
-
-    def open_chat_session(self, event):
-        selection = self.history_listbox.curselection()
-        if selection:
-            index = selection[0]
-            title = self.history_listbox.get(index)
-            history = self.chat_sessions.get(title, [])
-            ChatHistoryPopup(self, title, history)
-
-def get_search_result(query, api_key, search_engine_id):
-    if not api_key or not search_engine_id:
-        logging.error("Google API Key or Search Engine ID not provided.")
-        return "Error: Google API Key or Search Engine ID not provided."
-
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {
-        "key": api_key,
-        "cx": search_engine_id,
-        "q": query
-    }
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        results = response.json()
-        items = results.get("items", [])
-        summary = ""
-        for item in items[:3]:  # Get top 3 results
-            title = item.get("title")
-            snippet = item.get("snippet")
-            link = item.get("link")
-            summary += f"Title: {title}\nSnippet: {snippet}\nLink: {link}\n\n"
-        logging.info("Search results retrieved successfully.")
-        return summary.strip()
-    except Exception as e:
-        logging.error(f"Error fetching search results: {e}")
-        return f"Error fetching search results: {e}"
-
-class ProfilesDialog(tk.Toplevel):
-    def __init__(self, parent):
-        super().__init__(parent)
-        self.title("Manage Agent Profiles")
-        self.parent = parent
-        self.agent_profiles = self.parent.agent_profiles
-        self.create_widgets()
-        self.geometry("800x600")
-
-    def create_widgets(self):
-        # Agent selection listbox
-        listbox_frame = ttk.Frame(self)
-        listbox_frame.pack(side=tk.LEFT, fill=tk.Y, padx=10, pady=10)
-
-        ttk.Label(listbox_frame, text="Select Agent:").pack(anchor="w")
-        self.agent_listbox = tk.Listbox(listbox_frame)
-        self.agent_listbox.pack(fill=tk.BOTH, expand=True)
-        for agent_name in self.agent_profiles.keys():
-            self.agent_listbox.insert(tk.END, agent_name)
-        self.agent_listbox.bind('<<ListboxSelect>>', self.on_agent_select)
-
-        # Profile editing frame
-        edit_frame = ttk.Frame(self)
-        edit_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-        ttk.Label(edit_frame, text="Model:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
-        self.model_entry = ttk.Entry(edit_frame, width=50)
-        self.model_entry.grid(row=0, column=1, padx=5, pady=5)
-
-        ttk.Label(edit_frame, text="System Prompt:").grid(row=1, column=0, padx=5, pady=5, sticky="ne")
-        self.prompt_text = ScrolledText(edit_frame, width=50, height=20)
-        self.prompt_text.grid(row=1, column=1, padx=5, pady=5)
-
-        # Save and Cancel buttons
-        button_frame = ttk.Frame(edit_frame)
-        button_frame.grid(row=2, column=1, padx=5, pady=10, sticky="e")
-
-        save_button = ttk.Button(button_frame, text="Save", command=self.save_profile)
-        save_button.pack(side=tk.RIGHT, padx=5)
-        cancel_button = ttk.Button(button_frame, text="Cancel", command=self.destroy)
-        cancel_button.pack(side=tk.RIGHT)
-
-        self.current_agent = None
-
-    def on_agent_select(self, event):
-        selection = self.agent_listbox.curselection()
-        if selection:
-            index = selection[0]
-            agent_name = self.agent_listbox.get(index)
-            self.current_agent = agent_name
-            profile = self.agent_profiles[agent_name]
-            self.model_entry.delete(0, tk.END)
-            self.model_entry.insert(0, profile.get('model', ''))
-            self.prompt_text.delete(1.0, tk.END)
-            self.prompt_text.insert(tk.END, profile.get('system_prompt', ''))
-
-    def save_profile(self):
-        if self.current_agent:
-            model = self.model_entry.get().strip()
-            system_prompt = self.prompt_text.get(1.0, tk.END).strip()
-            self.agent_profiles[self.current_agent]['model'] = model
-            self.agent_profiles[self.current_agent]['system_prompt'] = system_prompt
-            self.parent.save_agent_profiles()
-            logging.info(f"Agent profile for {self.current_agent} saved.")
-            messagebox.showinfo("Profile Saved", f"Profile for {self.current_agent} has been saved.")
-        else:
-            messagebox.showwarning("No Agent Selected", "Please select an agent to save.")
-
-class ChatHistoryPopup(tk.Toplevel):
-    def __init__(self, parent, title, history):
-        super().__init__(parent)
-        self.title(title)
-        self.geometry("800x600")
-        self.configure_ui(history)
-
-    def configure_ui(self, history):
-        history_text = ScrolledText(self, font=("Helvetica", 12), state='disabled', wrap='word')
-        history_text.pack(fill=tk.BOTH, expand=True, pady=5)
-        history_text.configure(state='normal')
-        for entry in history:
-            history_text.insert(tk.END, f"{entry['role']}: {entry['message']}\n\n")
-        history_text.configure(state='disabled')
-
-class SettingsDialog(tk.Toplevel):
-    def __init__(self, parent):
-        super().__init__(parent)
-        self.title("Settings")
-        self.parent = parent
-        self.create_widgets()
-        self.geometry("600x400")
-
-    def create_widgets(self):
-        # OpenAI API Key
-        ttk.Label(self, text="OpenAI API Key:").grid(row=0, column=0, padx=10, pady=10, sticky="e")
-        self.openai_entry = ttk.Entry(self, width=50, show="*")
-        self.openai_entry.grid(row=0, column=1, padx=10, pady=10, sticky="w")
-        self.openai_entry.insert(0, self.parent.api_key or "")
+    def submit_query(self, event=None):
+        user_query = self.user_input.get().strip()
+        if not user_query:
+            messagebox.showwarning("No Input", "Please enter a query to submit.")
+            return
+        deadline = self.get_deadline()
+        if deadline is False:
+            return
+        self.user_input.delete(0, tk.END)
+        # Generate title
+        title = ' '.join(user_query.split()[:8])
+        self.add_session(title)
+        # Add user message to conversation
+        self.save_message(title, "User", user_query)
+        self.update_conversation_display(title, "User", user_query)
 
-        # Google API Key
-        ttk.Label(self, text="Google API Key:").grid(row=1, column=0, padx=10, pady=10, sticky="e")
-        self.google_entry = ttk.Entry(self, width=50, show="*")
-        self.google_entry.grid(row=1, column=1, padx=10, pady=10, sticky="w")
-        self.google_entry.insert(0, self.parent.google_api_key or "")
+        # Start processing in a new thread
+        global stop_flag
+        stop_flag = False
+        self.progress.start()
+        query_thread = threading.Thread(target=self.process_query, args=(title, user_query, None, deadline))
+        query_thread.start()
 
-        # Search Engine ID
-        ttk.Label(self, text="Search Engine ID:").grid(row=2, column=0, padx=10, pady=10, sticky="e")
-        self.se_id_entry = ttk.Entry(self, width=50)
-        self.se_id_entry.grid(row=2, column=1, padx=10, pady=10, sticky="w")
-        self.se_id_entry.insert(0, self.parent.search_engine_id or "")
+    def resume_query(self):
+        run_id = self.checkpoints.latest_run_id()
+        if not run_id:
+            messagebox.showinfo("Nothing to Resume", "There is no checkpointed run to resume.")
+            return
+        deadline = self.get_deadline()
+        if deadline is False:
+            return
+        title = self.checkpoints.get_run(run_id)["title"]
+        self.add_session(title)
 
-        # Save and Cancel buttons
-        button_frame = ttk.Frame(self)
-        button_frame.grid(row=3, column=1, padx=10, pady=20, sticky="e")
+        global stop_flag
+        stop_flag = False
+        self.progress.start()
+        query_thread = threading.Thread(target=self.process_query, args=(title, None, run_id, deadline))
+        query_thread.start()
 
-        save_button = ttk.Button(button_frame, text="Save", command=self.save_settings)
-        save_button.pack(side=tk.RIGHT, padx=5)
-        cancel_button = ttk.Button(button_frame, text="Cancel", command=self.destroy)
-        cancel_button.pack(side=tk.RIGHT)
+    def get_deadline(self):
+        # None means no budget; False means the entry is invalid and has been reported
+        value = self.deadline_spinbox.get().strip()
+        if not value:
+            return None
+        try:
+            deadline = float(value)
+        except ValueError:
+            messagebox.showwarning("Invalid Deadline", "The deadline must be a number of seconds.")
+            return False
+        return deadline if deadline > 0 else None
+
+    def create_engine(self):
+        return MultiAgentEngine(
+            self.agent_profiles,
+            google_api_key=self.google_api_key,
+            search_engine_id=self.search_engine_id,
+            checkpoints=self.checkpoints,
+            on_output=self.add_conversation,
+            priority="interactive"
+        )
 
-    def save_settings(self):
-        openai_key = self.openai_entry.get().strip()
-        google_key = self.google_entry.get().strip()
-        search_engine_id = self.se_id_entry.get().strip()
+    def process_query(self, title, user_query, run_id=None, deadline=None):
+        try:
+            self.status_label.configure(text="")
+            engine = self.create_engine()
+            if user_query is None:
+                courier = engine.resume(run_id, deadline)
+            else:
+                courier = engine.run(user_query, title, deadline=deadline)
+            if engine.degraded or engine.timed_out:
+                self.status_label.configure(text=f"Degraded: {engine.degradation_summary()}")
+            if courier is None:
+                return
+            # Add final output to the conversation
+            self.add_conversation("User", courier, title)
+            logging.info("All agents processed successfully.")
+        except Exception as e:
+            logging.error(f"Error processing query: {e}")
+            messagebox.showerror("Processing Error", f"An error occurred: {e}")
+        finally:
+            self.progress.stop()
 
-        if openai_key:
-            self.parent.api_key = openai_key
-            openai.api_key = openai_key
-            self.parent.save_config("OPENAI_API_KEY", openai_key)
-            logging.info("OpenAI API key updated.")
-        if google_key:
-            self.parent.google_api_key = google_key
-            self.parent.save_config("GOOGLE_API_KEY", google_key)
-            logging.info("Google API key updated.")
-        if search_engine_id:
-            self.parent.search_engine_id = search_engine_id
-            self.parent.save_config("SEARCH_ENGINE_ID", search_engine_id)
-            logging.info("Search Engine ID updated.")
+    def process_document(self, title, instruction, open_source, deadline=None):
+        try:
+            self.status_label.configure(text="")
+            engine = self.create_engine()
+            # The document is opened here so it is read in chunks off the UI thread
+            with open_source() as source:
+                courier = engine.run_document(source, instruction, title, deadline)
+            if engine.degraded or engine.timed_out:
+                self.status_label.configure(text=f"Degraded: {engine.degradation_summary()}")
+            if courier is None:
+                return
+            self.add_conversation("User", courier, title)
+            logging.info("Document processed successfully.")
+        except Exception as e:
+            logging.error(f"Error processing document: {e}")
+            messagebox.showerror("Processing Error", f"An error occurred: {e}")
+        finally:
+            self.progress.stop()
 
-        messagebox.showinfo("Settings Saved", "API keys and settings have been saved successfully.")
-        self.destroy()
+    def add_conversation(self, agent_name, content, title=None):
+        self.conversation_text.configure(state='normal')
+        self.conversation_text.insert(tk.END, f"{agent_name}: {content}\n\n")
+        self.conversation_text.see(tk.END)
+        self.conversation_text.configure(state='disabled')
+        # Find current session title
+        if not self.session_titles:
+            return
+        current_title = title if title in self.session_titles else self.session_titles[-1]
+        # Add to chat session
+        self.save_message(current_title, agent_name, content)
 
-    def save_config(self, key, value):
-        config_path = self.parent.config_file
-        config = {}
-        if os.path.exists(config_path):
-            with open(config_path, "r") as file:
-                for line in file:
-                    if '=' in line:
-                        k, v = line.strip().split('=', 1)
-                        config[k] = v
-        config[key] = value
-        with open(config_path, "w") as file:
-            for k, v in config.items():
-                file.write(f"{k}={v}\n")
-        logging.info(f"{key} saved successfully.")
+    def update_conversation_display(self, title, role, message):
+        self.conversation_text.configure(state='normal')
+        self.conversation_text.insert(tk.END, f"{role}: {message}\n\n")
+        self.conversation_text.configure(state='disabled')
+        self.conversation_text.see(tk.END)
+
+    def open_chat_session(self, event):
+        selection = self.history_listbox.curselection()
+        if selection:
+            index = selection[0]
+            title = self.history_listbox.get(index)
+            history = self.session_store.load_session(title)
+            ChatHistoryPopup(self, title, history)
 
-def get_search_result(query, api_key, search_engine_id):
+def get_search_result(query, api_key, search_engine_id, fetch_pages=False, deadline=None):
     if not api_key or not search_engine_id:
         logging.error("Google API Key or Search Engine ID not provided.")
         return "Error: Google API Key or Search Engine ID not provided."
 
-    url = "https://www.googleapis.com/customsearch/v1"
+    url = GOOGLE_SEARCH_URL
     params = {
         "key": api_key,
         "cx": search_engine_id,
         "q": query
     }
+    timeout = transport.timeout("search")
+    if deadline:
+        # A deadline run cannot wait out the full search timeout
+        remaining = max(0.5, deadline - time.monotonic())
+        timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
     try:
-        response = requests.get(url, params=params)
+        response = http_get(url, params=params, timeout=timeout, session=transport.session("search"))
         response.raise_for_status()
         results = response.json()
         items = results.get("items", [])
@@ -799,12 +2642,209 @@ def get_search_result(query, api_key, search_engine_id):
             snippet = item.get("snippet")
             link = item.get("link")
             summary += f"Title: {title}\nSnippet: {snippet}\nLink: {link}\n\n"
+        if fetch_pages:
+            links = [item.get("link") for item in items[:3] if item.get("link")]
+            passages = fetch_relevant_passages(query, links, deadline)
+            if passages:
+                summary += "Relevant Passages:\n\n"
+                for index, (link, passage) in enumerate(passages, 1):
+                    summary += f"[{index}] Source: {link}\n{passage}\n\n"
         logging.info("Search results retrieved successfully.")
         return summary.strip()
     except Exception as e:
         logging.error(f"Error fetching search results: {e}")
         return f"Error fetching search results: {e}"
 
+# Page fetching for Scribe when its profile sets "fetch_pages": true
+PAGE_CACHE_DIR = "page_cache"
+PAGE_MAX_BYTES = 1_000_000
+PAGE_DEADLINE = 8.0  # seconds for all pages together
+PASSAGE_CHARS = 800
+TOP_PASSAGES = 6
+
+SKIPPED_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "template", "iframe"}
+BLOCK_TAGS = {"p", "div", "li", "br", "tr", "section", "article", "main", "blockquote", "pre",
+              "h1", "h2", "h3", "h4", "h5", "h6", "dd", "dt", "table", "ul", "ol"}
+
+class TextExtractor(HTMLParser):
+    """Collects visible text, keeping <main>/<article> content separately as the likely main text."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.main_parts = []
+        self.skip_depth = 0
+        self.main_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in ("main", "article"):
+            self.main_depth += 1
+        if tag in BLOCK_TAGS:
+            self.add("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in ("main", "article") and self.main_depth:
+            self.main_depth -= 1
+        if tag in BLOCK_TAGS:
+            self.add("\n\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.add(data)
+
+    def add(self, text):
+        self.parts.append(text)
+        if self.main_depth:
+            self.main_parts.append(text)
+
+    def text(self):
+        main_text = clean_extracted_text("".join(self.main_parts))
+        return main_text if len(main_text) >= 500 else clean_extracted_text("".join(self.parts))
+
+def clean_extracted_text(text):
+    paragraphs = (re.sub(r"\s+", " ", paragraph).strip() for paragraph in re.split(r"\n\s*\n", text))
+    # Short fragments are mostly menus, buttons and captions
+    return "\n\n".join(p for p in paragraphs if len(p.split()) >= 5)
+
+def extract_text(html):
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+def page_cache_path(url):
+    return os.path.join(PAGE_CACHE_DIR, hash_text(url) + ".json")
+
+def fetch_page(url, deadline):
+    """Fetch a page's main text, revalidating any cached copy with its ETag or Last-Modified date."""
+    cache_path = page_cache_path(url)
+    cached = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if not isinstance(cached, dict) or not isinstance(cached.get("text"), str):
+                raise ValueError("missing page text")
+        except (OSError, ValueError) as e:
+            # A damaged entry is a miss; the fetch below rewrites it
+            logging.warning(f"Ignoring unreadable page cache entry {cache_path}: {e}")
+            cached = None
+    headers = {"User-Agent": "MASCOT/1.0"}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    response = http_get(
+        url, headers=headers, timeout=transport.timeout("pages"), stream=True, session=transport.session("pages")
+    )
+    try:
+        if response.status_code == 304 and cached:
+            return cached["text"]
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "")
+        if content_type and not content_type.startswith(("text/html", "text/plain", "application/xhtml")):
+            raise ValueError(f"Unsupported content type {content_type}")
+        body = b""
+        cut_short = False
+        for chunk in response.iter_content(chunk_size=16384):
+            body += chunk
+            if len(body) >= PAGE_MAX_BYTES:
+                break
+            if time.monotonic() >= deadline:
+                cut_short = True
+                break
+        html = body[:PAGE_MAX_BYTES].decode(response.encoding or "utf-8", errors="replace")
+    finally:
+        response.close()
+    text = extract_text(html) if "html" in content_type or "<" in html[:1000] else clean_extracted_text(html)
+    if cut_short:
+        # A body cut off by the deadline must not be revalidated and served as the whole page later
+        logging.info(f"Page {url} was cut off by the deadline and will not be cached.")
+        return text
+    os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+    # Written to a temporary file and renamed, so readers never see a half-written entry
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "text": text,
+            }, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not cache page {url}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return text
+
+def chunk_text(text, size=PASSAGE_CHARS):
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        # Split overlong paragraphs at sentence boundaries, then hard at the size limit
+        pieces = SENTENCE_PATTERN.split(paragraph) if len(paragraph) > size else [paragraph]
+        for piece in pieces:
+            while len(piece) > size:
+                chunks.append(piece[:size])
+                piece = piece[size:]
+            if current and len(current) + len(piece) + 1 > size:
+                chunks.append(current)
+                current = ""
+            current = f"{current} {piece}".strip() if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def rank_passages(query, passages, top_k=TOP_PASSAGES):
+    """Score (url, passage) pairs against the query with BM25 and return the best ones."""
+    query_terms = {w for w in WORD_PATTERN.findall(query.lower()) if w not in STOP_WORDS}
+    if not passages or not query_terms:
+        return passages[:top_k]
+    tokenized = [WORD_PATTERN.findall(passage.lower()) for _, passage in passages]
+    average_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1
+    document_frequency = collections.Counter(term for tokens in tokenized for term in set(tokens) & query_terms)
+    scores = []
+    for tokens in tokenized:
+        counts = collections.Counter(tokens)
+        score = 0.0
+        for term in query_terms & counts.keys():
+            idf = math.log(1 + (len(tokenized) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            tf = counts[term]
+            score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(tokens) / average_length))
+        scores.append(score)
+    ranked = sorted(range(len(passages)), key=lambda i: scores[i], reverse=True)[:top_k]
+    return [passages[i] for i in ranked if scores[i] > 0]
+
+def fetch_relevant_passages(query, urls, deadline=None):
+    """Fetch pages concurrently and return the passages most relevant to the query.
+
+    Pages still loading when PAGE_DEADLINE passes, or the earlier deadline given, are
+    left out, so the added latency is bounded by the deadline rather than the sum of all fetches.
+    """
+    deadline = min(time.monotonic() + PAGE_DEADLINE, deadline or math.inf)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(urls)))
+    futures = {pool.submit(fetch_page, url, deadline): url for url in urls}
+    done, not_done = concurrent.futures.wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    # Drop fetches that have not started; shutdown(cancel_futures=True) needs Python 3.9
+    for future in not_done:
+        future.cancel()
+    pool.shutdown(wait=False)
+    if not_done:
+        logging.info(f"Skipped {len(not_done)} pages that did not load before the deadline.")
+    passages = []
+    for future in done:
+        try:
+            passages.extend((futures[future], chunk) for chunk in chunk_text(future.result()))
+        except Exception as e:
+            logging.warning(f"Error fetching page {futures[future]}: {e}")
+    return rank_passages(query, passages)
+
 class ProfilesDialog(tk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
@@ -834,13 +2874,31 @@ class ProfilesDialog(tk.Toplevel):
         self.model_entry = ttk.Entry(edit_frame, width=50)
         self.model_entry.grid(row=0, column=1, padx=5, pady=5)
 
-        ttk.Label(edit_frame, text="System Prompt:").grid(row=1, column=0, padx=5, pady=5, sticky="ne")
-        self.prompt_text = ScrolledText(edit_frame, width=50, height=20)
-        self.prompt_text.grid(row=1, column=1, padx=5, pady=5)
+        # "local" is only offered for agents with a built-in implementation
+        ttk.Label(edit_frame, text="Type:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
+        self.type_combobox = ttk.Combobox(edit_frame, width=47, state="readonly", values=["llm"])
+        self.type_combobox.grid(row=1, column=1, padx=5, pady=5)
+
+        ttk.Label(edit_frame, text="Mode:").grid(row=2, column=0, padx=5, pady=5, sticky="e")
+        self.mode_combobox = ttk.Combobox(edit_frame, width=47, values=AGENT_MODES)
+        self.mode_combobox.grid(row=2, column=1, padx=5, pady=5)
+
+        # Optional OpenAI-compatible endpoint; leave blank to use the default OpenAI API
+        ttk.Label(edit_frame, text="Base URL:").grid(row=3, column=0, padx=5, pady=5, sticky="e")
+        self.base_url_entry = ttk.Entry(edit_frame, width=50)
+        self.base_url_entry.grid(row=3, column=1, padx=5, pady=5)
+
+        ttk.Label(edit_frame, text="API Key:").grid(row=4, column=0, padx=5, pady=5, sticky="e")
+        self.api_key_entry = ttk.Entry(edit_frame, width=50, show="*")
+        self.api_key_entry.grid(row=4, column=1, padx=5, pady=5)
+
+        ttk.Label(edit_frame, text="System Prompt:").grid(row=5, column=0, padx=5, pady=5, sticky="ne")
+        self.prompt_text = ScrolledText(edit_frame, width=50, height=16)
+        self.prompt_text.grid(row=5, column=1, padx=5, pady=5)
 
         # Save and Cancel buttons
         button_frame = ttk.Frame(edit_frame)
-        button_frame.grid(row=2, column=1, padx=5, pady=10, sticky="e")
+        button_frame.grid(row=6, column=1, padx=5, pady=10, sticky="e")
 
         save_button = ttk.Button(button_frame, text="Save", command=self.save_profile)
         save_button.pack(side=tk.RIGHT, padx=5)
@@ -858,6 +2916,13 @@ class ProfilesDialog(tk.Toplevel):
             profile = self.agent_profiles[agent_name]
             self.model_entry.delete(0, tk.END)
             self.model_entry.insert(0, profile.get('model', ''))
+            self.type_combobox.configure(values=["llm", "local"] if agent_name in LOCAL_AGENTS else ["llm"])
+            self.type_combobox.set(profile.get('type', 'llm'))
+            self.mode_combobox.set(profile.get('mode', ''))
+            self.base_url_entry.delete(0, tk.END)
+            self.base_url_entry.insert(0, profile.get('base_url', ''))
+            self.api_key_entry.delete(0, tk.END)
+            self.api_key_entry.insert(0, profile.get('api_key', ''))
             self.prompt_text.delete(1.0, tk.END)
             self.prompt_text.insert(tk.END, profile.get('system_prompt', ''))
 
@@ -867,6 +2932,14 @@ class ProfilesDialog(tk.Toplevel):
             system_prompt = self.prompt_text.get(1.0, tk.END).strip()
             self.agent_profiles[self.current_agent]['model'] = model
             self.agent_profiles[self.current_agent]['system_prompt'] = system_prompt
+            self.agent_profiles[self.current_agent]['type'] = self.type_combobox.get() or 'llm'
+            for key, entry in (('mode', self.mode_combobox), ('base_url', self.base_url_entry),
+                               ('api_key', self.api_key_entry)):
+                value = entry.get().strip()
+                if value:
+                    self.agent_profiles[self.current_agent][key] = value
+                else:
+                    self.agent_profiles[self.current_agent].pop(key, None)
             self.parent.save_agent_profiles()
             logging.info(f"Agent profile for {self.current_agent} saved.")
             messagebox.showinfo("Profile Saved", f"Profile for {self.current_agent} has been saved.")
@@ -888,6 +2961,189 @@ class ChatHistoryPopup(tk.Toplevel):
             history_text.insert(tk.END, f"{entry['role']}: {entry['message']}\n\n")
         history_text.configure(state='disabled')
 
+class ExportDialog(tk.Toplevel):
+    def __init__(self, parent, selected_titles):
+        super().__init__(parent)
+        self.title("Export Chat History")
+        self.parent = parent
+        self.selected_titles = selected_titles
+        self.cancel_event = threading.Event()
+        self.worker = None
+        self.create_widgets()
+        self.geometry("520x420")
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+
+    def create_widgets(self):
+        ttk.Label(self, text="Format:").grid(row=0, column=0, padx=10, pady=5, sticky="e")
+        self.format_combobox = ttk.Combobox(self, state="readonly", values=list(EXPORT_FORMATS))
+        self.format_combobox.set("json")
+        self.format_combobox.grid(row=0, column=1, padx=10, pady=5, sticky="w")
+
+        ttk.Label(self, text="From (YYYY-MM-DD):").grid(row=1, column=0, padx=10, pady=5, sticky="e")
+        self.since_entry = ttk.Entry(self, width=20)
+        self.since_entry.grid(row=1, column=1, padx=10, pady=5, sticky="w")
+
+        ttk.Label(self, text="To (YYYY-MM-DD):").grid(row=2, column=0, padx=10, pady=5, sticky="e")
+        self.until_entry = ttk.Entry(self, width=20)
+        self.until_entry.grid(row=2, column=1, padx=10, pady=5, sticky="w")
+
+        self.selected_only = tk.BooleanVar(value=bool(self.selected_titles))
+        selected_check = ttk.Checkbutton(
+            self, text=f"Only selected sessions ({len(self.selected_titles)})", variable=self.selected_only
+        )
+        selected_check.grid(row=3, column=1, padx=10, pady=5, sticky="w")
+        if not self.selected_titles:
+            selected_check.state(["disabled"])
+
+        ttk.Label(self, text="Roles:").grid(row=4, column=0, padx=10, pady=5, sticky="ne")
+        roles_frame = ttk.Frame(self)
+        roles_frame.grid(row=4, column=1, padx=10, pady=5, sticky="w")
+        self.role_vars = {}
+        for index, role in enumerate(["User"] + [stage for stage, _ in PIPELINE_STAGES]):
+            self.role_vars[role] = tk.BooleanVar(value=True)
+            ttk.Checkbutton(roles_frame, text=role, variable=self.role_vars[role]).grid(
+                row=index // 3, column=index % 3, sticky="w", padx=(0, 10)
+            )
+
+        self.progress = ttk.Progressbar(self, mode='determinate')
+        self.progress.grid(row=5, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+        self.columnconfigure(1, weight=1)
+
+        # Export and Cancel buttons
+        button_frame = ttk.Frame(self)
+        button_frame.grid(row=6, column=1, padx=10, pady=10, sticky="e")
+
+        self.export_button = ttk.Button(button_frame, text="Export", command=self.start_export)
+        self.export_button.pack(side=tk.RIGHT, padx=5)
+        cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel)
+        cancel_button.pack(side=tk.RIGHT)
+
+    def start_export(self):
+        fmt = self.format_combobox.get()
+        try:
+            since = parse_date(self.since_entry.get().strip()) if self.since_entry.get().strip() else None
+            until = parse_date(self.until_entry.get().strip(), True) if self.until_entry.get().strip() else None
+        except ValueError:
+            messagebox.showwarning("Invalid Date", "Please enter dates as YYYY-MM-DD.", parent=self)
+            return
+        roles = {role for role, var in self.role_vars.items() if var.get()}
+        if not roles:
+            messagebox.showwarning("No Roles Selected", "Please select at least one role to export.", parent=self)
+            return
+        file_path = filedialog.asksaveasfilename(
+            parent=self,
+            title="Export Chat History",
+            defaultextension=EXPORT_FORMATS[fmt],
+            filetypes=[(f"{fmt.upper()} files", f"*{EXPORT_FORMATS[fmt]}"), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        self.export_button.state(["disabled"])
+        self.file_path = file_path
+        self.done = (0, 1)
+        self.result = None
+        self.error = None
+        titles = set(self.selected_titles) if self.selected_only.get() else None
+        # Export runs off the UI thread; poll_export picks up progress and the result
+        self.worker = threading.Thread(
+            target=self.run_export, args=(fmt, since, until, titles, roles), daemon=True
+        )
+        self.worker.start()
+        self.poll_export()
+
+    def run_export(self, fmt, since, until, titles, roles):
+        try:
+            self.result = export_sessions(
+                self.parent.session_store, self.file_path, fmt, since, until, titles, roles,
+                progress=self.set_progress, cancel_event=self.cancel_event
+            )
+        except Exception as e:
+            logging.error(f"Error exporting chat history: {e}")
+            self.error = e
+
+    def set_progress(self, done, total):
+        self.done = (done, total)
+
+    def poll_export(self):
+        done, total = self.done
+        self.progress.configure(maximum=max(total, 1), value=done)
+        if self.worker.is_alive():
+            self.after(100, self.poll_export)
+            return
+        if self.error:
+            messagebox.showerror("Export Failed", f"An error occurred: {self.error}", parent=self)
+        elif self.result is not None:
+            messagebox.showinfo(
+                "Export Successful", f"{self.result} chat sessions exported to {self.file_path}.", parent=self
+            )
+        self.destroy()
+
+    def cancel(self):
+        if self.worker and self.worker.is_alive():
+            self.cancel_event.set()
+        else:
+            self.destroy()
+
+class DocumentDialog(tk.Toplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Ingest Document")
+        self.parent = parent
+        self.create_widgets()
+        self.geometry("640x480")
+
+    def create_widgets(self):
+        ttk.Label(self, text="Instruction:").grid(row=0, column=0, padx=10, pady=5, sticky="e")
+        self.instruction_entry = ttk.Entry(self)
+        self.instruction_entry.insert(0, DOCUMENT_DEFAULT_INSTRUCTION)
+        self.instruction_entry.grid(row=0, column=1, columnspan=2, padx=10, pady=5, sticky="ew")
+
+        ttk.Label(self, text="File:").grid(row=1, column=0, padx=10, pady=5, sticky="e")
+        self.file_entry = ttk.Entry(self)
+        self.file_entry.grid(row=1, column=1, padx=10, pady=5, sticky="ew")
+        ttk.Button(self, text="Browse...", command=self.browse).grid(row=1, column=2, padx=10, pady=5)
+
+        ttk.Label(self, text="Or paste text:").grid(row=2, column=0, padx=10, pady=5, sticky="ne")
+        self.text = ScrolledText(self, wrap=tk.WORD, height=16)
+        self.text.grid(row=2, column=1, columnspan=2, padx=10, pady=5, sticky="nsew")
+        self.columnconfigure(1, weight=1)
+        self.rowconfigure(2, weight=1)
+
+        # Ingest and Cancel buttons
+        button_frame = ttk.Frame(self)
+        button_frame.grid(row=3, column=1, columnspan=2, padx=10, pady=10, sticky="e")
+        ttk.Button(button_frame, text="Ingest", command=self.ingest).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Cancel", command=self.destroy).pack(side=tk.RIGHT)
+
+    def browse(self):
+        file_path = filedialog.askopenfilename(
+            parent=self,
+            title="Select Document",
+            filetypes=[("Text files", "*.txt *.md *.csv *.json *.html"), ("All files", "*.*")]
+        )
+        if file_path:
+            self.file_entry.delete(0, tk.END)
+            self.file_entry.insert(0, file_path)
+
+    def ingest(self):
+        instruction = self.instruction_entry.get().strip()
+        file_path = self.file_entry.get().strip()
+        if file_path:
+            if not os.path.isfile(file_path):
+                messagebox.showwarning("File Not Found", f"{file_path} does not exist.", parent=self)
+                return
+            self.parent.submit_document(
+                instruction, lambda: open(file_path, encoding="utf-8", errors="replace"),
+                os.path.basename(file_path)
+            )
+        else:
+            text = self.text.get("1.0", tk.END)
+            if not text.strip():
+                messagebox.showwarning("No Document", "Please choose a file or paste some text.", parent=self)
+                return
+            self.parent.submit_document(instruction, lambda: io.StringIO(text), f"pasted text, {len(text)} characters")
+        self.destroy()
+
 class SettingsDialog(tk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
@@ -961,34 +3217,734 @@ class SettingsDialog(tk.Toplevel):
                 file.write(f"{k}={v}\n")
         logging.info(f"{key} saved successfully.")
 
-def get_search_result(query, api_key, search_engine_id):
-    if not api_key or not search_engine_id:
-        logging.error("Google API Key or Search Engine ID not provided.")
-        return "Error: Google API Key or Search Engine ID not provided."
+# Service mode defaults; each can be overridden in config.env
+SERVICE_DEFAULTS = {
+    "SERVICE_QUEUE_FILE": "jobs.db",
+    "SERVICE_MAX_QUEUED": "200",
+    "SERVICE_MAX_QUEUED_PER_CLIENT": "20",
+    "SERVICE_POLL_INTERVAL": "1.0",
+    "SERVICE_STALE_AFTER": "120",
+    # Shared secret for workers pulling jobs over HTTP; remote workers are disabled while it is empty
+    "SERVICE_WORKER_TOKEN": "",
+}
+# Seconds a remote worker waits for the service to answer
+SERVICE_RPC_TIMEOUT = 30
+# CheckpointStore methods remote workers may call through the service
+CHECKPOINT_METHODS = ("start_run", "get_run", "latest_run_id", "load_stage", "save_stage", "complete_run")
+
+FINISHED_JOB_STATUSES = ("completed", "failed", "cancelled")
+
+class QueueFullError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+class JobQueue:
+    """Durable job queue shared by the HTTP service and any number of worker processes on one host."""
+
+    def __init__(self, path, max_queued=200, max_queued_per_client=20, stale_after=120):
+        self.path = path
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.stale_after = stale_after
+        with self.connect() as conn:
+            # WAL needs shared memory between processes, so the queue must stay on a local disk
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    client TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    priority TEXT NOT NULL DEFAULT 'batch',
+                    status TEXT NOT NULL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    heartbeat REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                );
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    run_id TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    title TEXT,
+                    input_hash TEXT NOT NULL,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS checkpoint_stages (
+                    run_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    PRIMARY KEY (run_id, stage)
+                );
+            """)
+            # Queues created before jobs had a priority class
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'batch'")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return contextlib.closing(conn)
+
+    def submit(self, client, query, priority="batch"):
+        job_id = uuid.uuid4().hex
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if queued >= self.max_queued:
+                    raise QueueFullError("The job queue is full. Retry later.", 503)
+                client_queued = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND client = ?", (client,)
+                ).fetchone()[0]
+                if client_queued >= self.max_queued_per_client:
+                    raise QueueFullError(f"Client {client} has too many queued jobs. Retry later.", 429)
+                conn.execute(
+                    "INSERT INTO jobs (id, client, query, priority, status, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+                    (job_id, client, query, priority, time.time())
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logging.info(f"Job {job_id} queued for client {client}.")
+        return job_id
+
+    def claim(self, worker):
+        """Atomically take the next job by priority class, then preferring clients with the fewest running jobs."""
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Requeue jobs whose worker stopped sending heartbeats; checkpoints let them resume
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL "
+                    "WHERE status = 'running' AND heartbeat < ?",
+                    (now - self.stale_after,)
+                )
+                row = conn.execute("""
+                    SELECT id, query, priority FROM jobs AS j
+                    WHERE status = 'queued'
+                    ORDER BY CASE priority WHEN 'interactive' THEN 0 WHEN 'batch' THEN 1 ELSE 2 END,
+                             (SELECT COUNT(*) FROM jobs AS r
+                              WHERE r.client = j.client AND r.status = 'running'),
+                             created
+                    LIMIT 1
+                """).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+                        (worker, now, now, row["id"])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return (row["id"], row["query"], row["priority"]) if row else None
+
+    def heartbeat(self, job_id):
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id)
+            )
+        logging.info(f"Job {job_id} {status}.")
 
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {
-        "key": api_key,
-        "cx": search_engine_id,
-        "q": query
-    }
-    try:
-        response = requests.get(url, params=params)
+    def cancel(self, job_id):
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return self.get(job_id)
+
+    def is_cancel_requested(self, job_id):
+        with self.connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def get(self, job_id):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT id, client, priority, status, result, error, created, started, finished FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def add_event(self, job_id, role, message):
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, seq, role, message, created) "
+                "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM job_events WHERE job_id = ?",
+                (job_id, role, message, time.time(), job_id)
+            )
+
+    def events_after(self, job_id, seq):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, role, message FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, seq)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def checkpoint_store(self):
+        return JobCheckpointStore(self)
+
+class JobCheckpointStore(CheckpointStore):
+    """CheckpointStore in the job queue database so every worker shares checkpoints."""
+
+    def __init__(self, queue):
+        # Jobs may be requeued long after they started, so their checkpoints are never pruned
+        super().__init__(queue.path, max_runs=None, legacy_path=None)
+
+class RemoteJobQueue:
+    """The job queue of a MASCOT service reached over HTTP, for workers on other hosts.
+
+    The service keeps jobs.db on its own disk; remote workers claim jobs, send
+    heartbeats, events and results, and share checkpoints through its /worker endpoints.
+    """
+
+    def __init__(self, server_url, token, stale_after=120):
+        self.server_url = server_url.rstrip("/")
+        self.token = token
+        self.stale_after = stale_after
+
+    def call(self, path, payload=None):
+        response = transport.session("service").post(
+            f"{self.server_url}/worker/{path}", json=payload or {},
+            headers={"Authorization": f"Bearer {self.token}"}, timeout=SERVICE_RPC_TIMEOUT
+        )
         response.raise_for_status()
-        results = response.json()
-        items = results.get("items", [])
-        summary = ""
-        for item in items[:3]:  # Get top 3 results
-            title = item.get("title")
-            snippet = item.get("snippet")
-            link = item.get("link")
-            summary += f"Title: {title}\nSnippet: {snippet}\nLink: {link}\n\n"
-        logging.info("Search results retrieved successfully.")
-        return summary.strip()
-    except Exception as e:
-        logging.error(f"Error fetching search results: {e}")
-        return f"Error fetching search results: {e}"
+        return response.json()
+
+    def claim(self, worker):
+        job = self.call("claim", {"worker": worker})["job"]
+        return (job["id"], job["query"], job["priority"]) if job else None
+
+    def heartbeat(self, job_id):
+        self.call(f"jobs/{job_id}/heartbeat")
+
+    def is_cancel_requested(self, job_id):
+        # Each check also counts as a heartbeat
+        return self.call(f"jobs/{job_id}/heartbeat")["cancel_requested"]
+
+    def add_event(self, job_id, role, message):
+        self.call(f"jobs/{job_id}/events", {"role": role, "message": message})
+
+    def finish(self, job_id, status, result=None, error=None):
+        self.call(f"jobs/{job_id}/finish", {"status": status, "result": result, "error": error})
+        logging.info(f"Job {job_id} {status}.")
+
+    def checkpoint_store(self):
+        return RemoteCheckpointStore(self)
+
+class RemoteCheckpointStore:
+    """CheckpointStore calls forwarded to the service, so remote workers resume requeued jobs too."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def call(self, method, *args):
+        return self.queue.call(f"checkpoints/{method}", {"args": list(args)})["result"]
+
+    def start_run(self, run_id, user_query, title, document=None):
+        self.call("start_run", run_id, user_query, title, document)
+
+    def get_run(self, run_id):
+        return self.call("get_run", run_id)
+
+    def latest_run_id(self):
+        return self.call("latest_run_id")
+
+    def load_stage(self, run_id, stage, fingerprint):
+        return self.call("load_stage", run_id, stage, fingerprint)
+
+    def save_stage(self, run_id, stage, fingerprint, output):
+        self.call("save_stage", run_id, stage, fingerprint, output)
+
+    def complete_run(self, run_id):
+        self.call("complete_run", run_id)
+
+def read_service_config(config_file="config.env"):
+    config = dict(SERVICE_DEFAULTS)
+    config.update(read_config(config_file))
+    return config
+
+def open_job_queue(config):
+    return JobQueue(
+        config["SERVICE_QUEUE_FILE"],
+        max_queued=int(config["SERVICE_MAX_QUEUED"]),
+        max_queued_per_client=int(config["SERVICE_MAX_QUEUED_PER_CLIENT"]),
+        stale_after=float(config["SERVICE_STALE_AFTER"])
+    )
+
+def run_job(queue, job_id, user_query, priority, config):
+    if config.get("OPENAI_API_KEY"):
+        openai.api_key = config["OPENAI_API_KEY"]
+    # run_worker configured the scheduler once; reconfiguring per job would reopen the lease file
+    engine = MultiAgentEngine(
+        read_agent_profiles("agent_profiles.json"),
+        google_api_key=config.get("GOOGLE_API_KEY"),
+        search_engine_id=config.get("SEARCH_ENGINE_ID"),
+        checkpoints=queue.checkpoint_store(),
+        on_output=lambda agent_name, content, title: queue.add_event(job_id, agent_name, content),
+        should_stop=lambda: queue.is_cancel_requested(job_id),
+        priority=priority
+    )
+    # The job id doubles as the run id, so a requeued job resumes from its checkpoints
+    engine.run(user_query, run_id=job_id)
+    if queue.is_cancel_requested(job_id):
+        queue.finish(job_id, "cancelled")
+    else:
+        queue.finish(job_id, "completed", result=engine.outputs.get("Courier"))
+
+def run_worker(config_file="config.env", server=None):
+    config = read_service_config(config_file)
+    if server:
+        if not config["SERVICE_WORKER_TOKEN"]:
+            raise ValueError("Set SERVICE_WORKER_TOKEN in config.env to pull jobs from a remote service.")
+        queue = RemoteJobQueue(server, config["SERVICE_WORKER_TOKEN"], float(config["SERVICE_STALE_AFTER"]))
+    else:
+        queue = open_job_queue(config)
+    poll_interval = float(config["SERVICE_POLL_INTERVAL"])
+    if config.get("OPENAI_API_KEY"):
+        openai.api_key = config["OPENAI_API_KEY"]
+    configure_scheduler(config)
+    configure_transport(config, read_agent_profiles("agent_profiles.json"))
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    logging.info(f"Worker {worker} started.")
+    while True:
+        try:
+            job = queue.claim(worker)
+        except requests.RequestException as e:
+            logging.warning(f"Could not reach the service to claim a job: {e}")
+            job = None
+        if not job:
+            time.sleep(poll_interval)
+            continue
+        job_id, user_query, priority = job
+        done = threading.Event()
+
+        def send_heartbeats():
+            while not done.wait(queue.stale_after / 4):
+                try:
+                    queue.heartbeat(job_id)
+                except requests.RequestException as e:
+                    logging.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+        threading.Thread(target=send_heartbeats, daemon=True).start()
+        try:
+            run_job(queue, job_id, user_query, priority, read_service_config(config_file))
+        except Exception as e:
+            logging.error(f"Error processing job {job_id}: {e}")
+            try:
+                queue.finish(job_id, "failed", error=str(e))
+            except requests.RequestException as e:
+                # The service requeues the job once its heartbeats stop
+                logging.error(f"Could not report job {job_id} as failed: {e}")
+        finally:
+            done.set()
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    # Set by serve()
+    queue = None
+    checkpoints = None
+    poll_interval = 1.0
+    worker_token = ""
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def path_parts(self):
+        return [part for part in self.path.split("?", 1)[0].split("/") if part]
+
+    def route(self):
+        # Returns the path below /jobs, e.g. [] for /jobs or [id, "cancel"] for /jobs/<id>/cancel
+        parts = self.path_parts()
+        if not parts or parts[0] != "jobs":
+            return None
+        return parts[1:]
+
+    def read_json(self):
+        """Return the JSON object in the request body, or None after replying 400."""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            self.send_json(400, {"error": "Request body must be a JSON object."})
+            return None
+        return payload
+
+    def do_POST(self):
+        if self.path_parts()[:1] == ["worker"]:
+            self.handle_worker(self.path_parts()[1:])
+            return
+        parts = self.route()
+        if parts == []:
+            self.submit_job()
+        elif parts and len(parts) == 2 and parts[1] == "cancel":
+            job_id = parts[0]
+            job = self.queue.cancel(job_id)
+            if job:
+                self.send_json(200, job)
+            else:
+                self.send_json(404, {"error": "Unknown job."})
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def do_GET(self):
+        parts = self.route()
+        if parts and len(parts) == 1:
+            job = self.queue.get(parts[0])
+            if job:
+                self.send_json(200, job)
+            else:
+                self.send_json(404, {"error": "Unknown job."})
+        elif parts and len(parts) == 2 and parts[1] == "stream":
+            self.stream_job(parts[0])
+        else:
+            self.send_json(404, {"error": "Not found."})
 
-if __name__ == "__main__":
+    def submit_job(self):
+        payload = self.read_json()
+        if payload is None:
+            return
+        user_query = str(payload.get("query", "")).strip()
+        if not user_query:
+            self.send_json(400, {"error": "Please provide a query."})
+            return
+        priority = payload.get("priority", "batch")
+        if priority not in PRIORITY_WEIGHTS:
+            self.send_json(400, {"error": f"Priority must be one of {', '.join(PRIORITY_WEIGHTS)}."})
+            return
+        client = self.headers.get("X-Client-Id") or payload.get("client") or self.client_address[0]
+        try:
+            job_id = self.queue.submit(str(client), user_query, priority)
+        except QueueFullError as e:
+            self.send_json(e.status, {"error": str(e)}, {"Retry-After": "5"})
+            return
+        self.send_json(202, {"id": job_id, "status": "queued"})
+
+    def handle_worker(self, parts):
+        # Endpoints for workers on other hosts; see RemoteJobQueue
+        if not self.worker_token:
+            self.send_json(404, {"error": "Remote workers are not enabled on this service."})
+            return
+        if not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {self.worker_token}"):
+            self.send_json(401, {"error": "Invalid worker token."})
+            return
+        payload = self.read_json()
+        if payload is None:
+            return
+        if parts == ["claim"]:
+            job = self.queue.claim(str(payload.get("worker") or self.client_address[0]))
+            self.send_json(200, {"job": dict(zip(("id", "query", "priority"), job)) if job else None})
+        elif len(parts) == 3 and parts[0] == "jobs":
+            job_id, action = parts[1], parts[2]
+            if not self.queue.get(job_id):
+                self.send_json(404, {"error": "Unknown job."})
+            elif action == "heartbeat":
+                self.queue.heartbeat(job_id)
+                self.send_json(200, {"cancel_requested": self.queue.is_cancel_requested(job_id)})
+            elif action == "events":
+                self.queue.add_event(job_id, str(payload.get("role", "")), str(payload.get("message", "")))
+                self.send_json(200, {})
+            elif action == "finish" and payload.get("status") in FINISHED_JOB_STATUSES:
+                self.queue.finish(job_id, payload["status"], payload.get("result"), payload.get("error"))
+                self.send_json(200, {})
+            else:
+                self.send_json(400, {"error": "Unknown worker action or job status."})
+        elif len(parts) == 2 and parts[0] == "checkpoints" and parts[1] in CHECKPOINT_METHODS:
+            args = payload.get("args", [])
+            try:
+                result = getattr(self.checkpoints, parts[1])(*args)
+            except TypeError as e:
+                self.send_json(400, {"error": f"Invalid checkpoint call: {e}"})
+                return
+            self.send_json(200, {"result": result})
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def stream_job(self, job_id):
+        if not self.queue.get(job_id):
+            self.send_json(404, {"error": "Unknown job."})
+            return
+        # Server-sent events: one event per agent output, then the final job status
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        seq = 0
+        try:
+            while True:
+                job = self.queue.get(job_id)
+                for event in self.queue.events_after(job_id, seq):
+                    seq = event["seq"]
+                    self.wfile.write(f"event: output\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+                if job["status"] in FINISHED_JOB_STATUSES:
+                    self.wfile.write(f"event: status\ndata: {json.dumps(job)}\n\n".encode("utf-8"))
+                    break
+                self.wfile.flush()
+                time.sleep(self.poll_interval)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info(f"Stream client for job {job_id} disconnected.")
+
+    def log_message(self, format, *args):
+        logging.info(f"Service {self.address_string()} - {format % args}")
+
+def serve(host, port, workers, config_file="config.env"):
+    config = read_service_config(config_file)
+    ServiceRequestHandler.queue = open_job_queue(config)
+    ServiceRequestHandler.checkpoints = ServiceRequestHandler.queue.checkpoint_store()
+    ServiceRequestHandler.poll_interval = float(config["SERVICE_POLL_INTERVAL"])
+    ServiceRequestHandler.worker_token = config["SERVICE_WORKER_TOKEN"]
+    processes = []
+    for _ in range(workers):
+        process = multiprocessing.Process(target=run_worker, args=(config_file,), daemon=True)
+        process.start()
+        processes.append(process)
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    logging.info(f"Service listening on {host}:{port} with {workers} local workers.")
+    print(f"MASCOT service listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for process in processes:
+            process.terminate()
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible endpoint that answers with the last user message.
+
+    Point an agent profile's Base URL at it to test endpoint routing without a
+    real inference server.
+    """
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json({"object": "list", "data": [{"id": "stand-in", "object": "model", "owned_by": "mascot"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        user_messages = [m.get("content") or "" for m in payload.get("messages", []) if m.get("role") == "user"]
+        content = user_messages[-1] if user_messages else ""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = payload.get("model", "stand-in")
+        if payload.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            pieces = [{"role": "assistant", "content": ""}] + [{"content": word} for word in re.findall(r"\S+\s*|\s+", content)]
+            for delta in pieces + [{}]:
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        words = len(content.split())
+        self.send_json({
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": words, "completion_tokens": words, "total_tokens": 2 * words}
+        })
+
+    def send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f"Stand-in {self.address_string()} - {format % args}")
+
+def serve_stand_in(host, port):
+    server = ThreadingHTTPServer((host, port), StandInRequestHandler)
+    print(f"Stand-in endpoint listening on http://{host}:{port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def print_output(agent_name, content, title=None):
+    print(f"{agent_name}: {content}\n", flush=True)
+
+def run_cli(args):
+    config = read_config("config.env")
+    if config.get("OPENAI_API_KEY"):
+        openai.api_key = config["OPENAI_API_KEY"]
+    configure_scheduler(config)
+    agent_profiles = read_agent_profiles("agent_profiles.json")
+    configure_transport(config, agent_profiles)
+    engine = MultiAgentEngine(
+        agent_profiles,
+        google_api_key=config.get("GOOGLE_API_KEY"),
+        search_engine_id=config.get("SEARCH_ENGINE_ID"),
+        on_output=print_output,
+        priority=args.priority
+    )
+    try:
+        if args.resume:
+            courier = engine.resume(None if args.resume == "latest" else args.resume, args.deadline)
+        elif args.document == "-":
+            courier = engine.run_document(sys.stdin, args.query, deadline=args.deadline)
+        elif args.document:
+            with open(args.document, encoding="utf-8", errors="replace") as source:
+                courier = engine.run_document(source, args.query, deadline=args.deadline)
+        else:
+            courier = engine.run(args.query, deadline=args.deadline)
+    except (ValueError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Stopped. Completed stages are checkpointed; run with --resume to continue.", file=sys.stderr)
+        return 130
+    if courier is None and not engine.timed_out:
+        print("Nothing left to run for this query.", file=sys.stderr)
+    return 0
+
+def run_export(args):
+    fmt = args.format or next(
+        (name for name, extension in EXPORT_FORMATS.items() if args.export.endswith(extension)), "json"
+    )
+    try:
+        since = parse_date(args.since) if args.since else None
+        until = parse_date(args.until, True) if args.until else None
+    except ValueError:
+        print("Dates must be given as YYYY-MM-DD or an ISO timestamp.", file=sys.stderr)
+        return 2
+    store = SessionStore("chat_history.db")
+    store.import_legacy("chat_history.json")
+    written = export_sessions(
+        store, args.export, fmt, since, until,
+        titles=set(args.session) if args.session else None,
+        roles=set(args.role) if args.role else None
+    )
+    print(f"Exported {written} chat sessions to {args.export}.", file=sys.stderr)
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-Agent Systemic Chain of Thought")
+    parser.add_argument("query", nargs="?", help="run a query without the GUI and print each agent's output")
+    parser.add_argument("--resume", nargs="?", const="latest", metavar="RUN_ID",
+                        help="continue a checkpointed run (default: the latest) from its first incomplete stage")
+    parser.add_argument("--priority", choices=list(PRIORITY_WEIGHTS), default="interactive",
+                        help="scheduling class for this query's model calls (default: interactive)")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="answer within SECONDS, degrading or skipping stages as needed")
+    parser.add_argument("--document", metavar="PATH",
+                        help="analyse a long document from PATH ('-' for stdin) in chunks; "
+                             "the query, if given, is the instruction")
+    parser.add_argument("--export", metavar="PATH", help="export chat history to PATH and exit")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS),
+                        help="export format (default: from the file extension, else json)")
+    parser.add_argument("--since", metavar="DATE", help="export only messages on or after DATE (YYYY-MM-DD)")
+    parser.add_argument("--until", metavar="DATE", help="export only messages on or before DATE (YYYY-MM-DD)")
+    parser.add_argument("--session", action="append", metavar="TITLE", help="export only this session (repeatable)")
+    parser.add_argument("--role", action="append", metavar="ROLE",
+                        help="export only messages from this role, e.g. User or Courier (repeatable)")
+    parser.add_argument("--serve", action="store_true", help="run the HTTP service instead of the GUI")
+    parser.add_argument("--host", default="127.0.0.1", help="service or stand-in bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="service or stand-in port (default: 8765)")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="worker processes started with --serve (default: one per CPU)")
+    parser.add_argument("--worker", action="store_true",
+                        help="only run a worker that pulls jobs from the queue named in config.env")
+    parser.add_argument("--server", metavar="URL",
+                        help="with --worker, pull jobs from the MASCOT service at URL instead of a local queue")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="run a local OpenAI-compatible endpoint that echoes the last user message")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument("--record", metavar="CASSETTE",
+                                help="record every OpenAI and search request and response to a cassette file")
+    cassette_group.add_argument("--replay", metavar="CASSETTE",
+                                help="serve OpenAI and search responses from a cassette instead of the network")
+    parser.add_argument("--replay-speed", choices=["recorded", "fast"], default="recorded",
+                        help="replay at the recorded latency or as fast as possible (default: recorded)")
+    parser.add_argument("--profile", metavar="OUTPUT",
+                        help="write cProfile stats for the run to OUTPUT and report peak memory")
+    return parser.parse_args(argv)
+
+def main(args):
+    if args.record or args.replay:
+        install_cassette(args.record or args.replay, "record" if args.record else "replay", args.replay_speed)
+    if args.export:
+        return run_export(args)
+    if args.serve:
+        serve(args.host, args.port, args.workers)
+        return 0
+    if args.stand_in:
+        serve_stand_in(args.host, args.port)
+        return 0
+    if args.worker:
+        try:
+            run_worker(server=args.server)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.query or args.resume or args.document:
+        return run_cli(args)
     app = MultiAgentApp()
     app.mainloop()
+    return 0
+
+def profile_main(args):
+    # Profile MASCOT's own overhead; pair with --replay so network time is out of the picture
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return main(args)
+    finally:
+        profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}; peak traced memory {peak / 1024 / 1024:.1f} MiB.", file=sys.stderr)
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    args = parse_args()
+    sys.exit(profile_main(args) if args.profile else main(args))